@@ -0,0 +1,109 @@
+"""Startup benchmark: import time of main and time to first WebSocket accept.
+
+Run from the backend directory:
+
+    python benchmarks/startup_benchmark.py --runs 5 --output startup_bench.jsonl
+
+Each invocation prints one JSON result and, with --output, appends it to a
+JSON lines file tagged with the current git commit so results can be
+compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+import websockets
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = (
+    "import sys, time, json\n"
+    "started = time.perf_counter()\n"
+    "import main\n"
+    "elapsed = time.perf_counter() - started\n"
+    "heavy = sorted(m for m in sys.modules if m in ('google.cloud.firestore', 'google.cloud.storage'))\n"
+    "print(json.dumps({'seconds': elapsed, 'heavy_modules': heavy}))\n"
+)
+
+def measure_import() -> dict:
+    """Import main in a fresh interpreter and report how long it took"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _wait_for_accept(port: int, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}/ws/benchmark-room/benchmark-user", open_timeout=1):
+                return
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"No WebSocket accept within {timeout}s")
+            await asyncio.sleep(0.01)
+
+def measure_first_accept(timeout: float) -> float:
+    """Start uvicorn and measure the time until the first WebSocket is accepted"""
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        asyncio.run(_wait_for_accept(port, timeout))
+        return time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts to measure")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the first accept")
+    parser.add_argument("--output", help="JSON lines file to append the result to")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.runs)]
+    accepts = [measure_first_accept(args.timeout) for _ in range(args.runs)]
+
+    result = {
+        "commit": _git_commit(),
+        "measured_at": datetime.now(timezone.utc).isoformat(),
+        "runs": args.runs,
+        "import_seconds_median": statistics.median(run["seconds"] for run in imports),
+        "first_ws_accept_seconds_median": statistics.median(accepts),
+        "first_ws_accept_seconds_max": max(accepts),
+        "heavy_modules_at_import": imports[0]["heavy_modules"],
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,62 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set
+from contextlib import asynccontextmanager
 import json
 import logging
 import os
+import time
+import threading
+import secrets
+import re
 from datetime import datetime
 import asyncio
+import gzip
+import tarfile
+import zipfile
+import brotli
 
-# Import services
-from services.firestore_service import FirestoreService
-from services.storage_service import StorageService
+# Services that wrap the Google Cloud SDKs are imported inside their getters
+# so that loading this module (and therefore a cold start) doesn't pay for them
+from services.archive_service import ArchiveService
+from services.diagnostics_service import LoopWatchdog, SamplingProfiler, ProfilerBusyError
+from services.room_transfer_service import RoomTransferService, EXPORT_FORMATS
 
 # Import models
 from models.message import Message
 from models.drawing import DrawingAction
 from models.user import User
+from models.events import BatchEvent, DrawingEvent, MessageEvent, ClearCanvasEvent
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Collaborative App Backend", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start serving immediately; clients are built in the background
+    background_tasks = [asyncio.create_task(prewarm_services())]
+    interval = int(os.getenv("ROOM_ARCHIVE_INTERVAL_SECONDS", 0))
+    if interval > 0:
+        background_tasks.append(asyncio.create_task(run_room_archival(interval)))
+    if watchdog.enabled:
+        watchdog.start()
+    yield
+    watchdog.stop()
+    for task in background_tasks:
+        task.cancel()
+    # Room version bumps are coalesced; don't drop the ones still waiting
+    if firestore_service is not None:
+        await firestore_service.flush_room_versions()
+
+app = FastAPI(title="Collaborative App Backend", version="1.0.0", lifespan=lifespan)
+
+# Event-loop diagnostics (LOOP_LAG_THRESHOLD_MS=0 disables the watchdog)
+watchdog = LoopWatchdog()
+profiler = SamplingProfiler()
 
 # CORS middleware
 app.add_middleware(
@@ -36,69 +70,212 @@ app.add_middleware(
 # Initialize services (lazy loading to avoid startup issues)
 firestore_service = None
 storage_service = None
+# Getters may run concurrently from the pre-warm threads and request handlers
+_firestore_lock = threading.Lock()
+_storage_lock = threading.Lock()
 
 def get_firestore_service():
     global firestore_service
     if firestore_service is None:
-        firestore_service = FirestoreService()
+        with _firestore_lock:
+            if firestore_service is None:
+                from services.firestore_service import FirestoreService
+                service = FirestoreService()
+                service.archive_service = ArchiveService(service, get_storage_service)
+                firestore_service = service
     return firestore_service
 
 def get_storage_service():
     global storage_service
     if storage_service is None:
-        storage_service = StorageService()
+        with _storage_lock:
+            if storage_service is None:
+                from services.storage_service import StorageService
+                storage_service = StorageService()
     return storage_service
 
+async def firestore_service_async():
+    """get_firestore_service() for the event loop: never waits on the build lock in the loop thread"""
+    if firestore_service is not None:
+        return firestore_service
+    return await asyncio.to_thread(get_firestore_service)
+
+async def storage_service_async():
+    """get_storage_service() for the event loop: never waits on the build lock in the loop thread"""
+    if storage_service is not None:
+        return storage_service
+    return await asyncio.to_thread(get_storage_service)
+
+def _prewarm_storage():
+    get_storage_service().check_bucket()
+
+async def prewarm_services():
+    """Build the Firestore and Storage clients concurrently off the event loop"""
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        asyncio.to_thread(get_firestore_service),
+        asyncio.to_thread(_prewarm_storage),
+        return_exceptions=True
+    )
+    for name, result in zip(("firestore", "storage"), results):
+        if isinstance(result, Exception):
+            logger.warning(f"Pre-warming {name} service failed: {result}")
+    logger.info(f"Services pre-warmed in {time.perf_counter() - started:.2f}s")
+
 # WebSocket connection manager
+class Subscriber:
+    """A WebSocket receiving broadcasts for one or more rooms"""
+
+    def __init__(self, websocket: WebSocket, user_id: str, multiplexed: bool = False, batch: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Multiplexed subscribers get every frame tagged with its room channel
+        self.multiplexed = multiplexed
+        # room_id -> encoded events waiting for the room's next flush, or None when not in batch mode
+        self.pending: Optional[Dict[str, List[str]]] = {} if batch else None
+        self.rooms: Set[str] = set()
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.user_rooms: Dict[str, str] = {}  # user_id -> room_id
+    def __init__(self, batch_window: float = None):
+        # room_id -> subscribers and websocket -> subscriber, so that subscribing,
+        # unsubscribing and disconnecting never scan other rooms or connections
+        self.active_connections: Dict[str, Dict[WebSocket, Subscriber]] = {}
+        self.subscribers: Dict[WebSocket, Subscriber] = {}
+        self.flush_tasks: Dict[str, asyncio.Task] = {}  # room_id -> scheduled flush
+        if batch_window is None:
+            batch_window = float(os.getenv("BROADCAST_BATCH_WINDOW_MS", 16)) / 1000
+        self.batch_window = batch_window
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str, batch: bool = False):
+        await self.connect_multiplexed(websocket, user_id, batch=batch, multiplexed=False)
+        await self.subscribe(websocket, room_id)
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
+    async def connect_multiplexed(self, websocket: WebSocket, user_id: str, batch: bool = False, multiplexed: bool = True):
         await websocket.accept()
-        
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        
-        self.active_connections[room_id].append(websocket)
-        self.user_rooms[user_id] = room_id
+        self.subscribers[websocket] = Subscriber(websocket, user_id, multiplexed, batch and self.batch_window > 0)
+
+    async def subscribe(self, websocket: WebSocket, room_id: str):
+        subscriber = self.subscribers[websocket]
+        if room_id in subscriber.rooms:
+            return
+        self.active_connections.setdefault(room_id, {})[websocket] = subscriber
+        subscriber.rooms.add(room_id)
         
         # Notify others in the room
         await self.broadcast_to_room(room_id, {
             "type": "user_joined",
-            "user_id": user_id,
+            "user_id": subscriber.user_id,
             "timestamp": datetime.now().isoformat()
         }, exclude_websocket=websocket)
 
-    def disconnect(self, websocket: WebSocket, user_id: str):
-        room_id = self.user_rooms.get(user_id)
-        if room_id and room_id in self.active_connections:
-            if websocket in self.active_connections[room_id]:
-                self.active_connections[room_id].remove(websocket)
+    async def unsubscribe(self, websocket: WebSocket, room_id: str):
+        subscriber = self.subscribers.get(websocket)
+        if subscriber is None or room_id not in subscriber.rooms:
+            return
+        # Events queued before the unsubscribe go out before it is acknowledged
+        await self._send_pending(room_id, subscriber)
+        self._leave(subscriber, room_id)
+        
+        # Notify others in the room
+        await self.broadcast_to_room(room_id, {
+            "type": "user_left",
+            "user_id": subscriber.user_id,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def _leave(self, subscriber: Subscriber, room_id: str):
+        subscriber.rooms.discard(room_id)
+        if subscriber.pending is not None:
+            subscriber.pending.pop(room_id, None)
+        connections = self.active_connections.get(room_id)
+        if connections is not None:
+            connections.pop(subscriber.websocket, None)
+            if not connections:
+                del self.active_connections[room_id]
+
+    def disconnect(self, websocket: WebSocket):
+        subscriber = self.subscribers.pop(websocket, None)
+        if subscriber is None:
+            return
+        for room_id in list(subscriber.rooms):
+            self._leave(subscriber, room_id)
             
             # Notify others in the room
             asyncio.create_task(self.broadcast_to_room(room_id, {
                 "type": "user_left",
-                "user_id": user_id,
+                "user_id": subscriber.user_id,
                 "timestamp": datetime.now().isoformat()
             }))
-        
-        if user_id in self.user_rooms:
-            del self.user_rooms[user_id]
+
+    def is_subscribed(self, websocket: WebSocket, room_id: str) -> bool:
+        subscriber = self.subscribers.get(websocket)
+        return subscriber is not None and room_id in subscriber.rooms
+
+    async def _send(self, room_id: str, subscriber: Subscriber, text: str):
+        try:
+            await subscriber.websocket.send_text(text)
+        except:
+            # Remove broken connections from the room's fan-out, keeping both indexes in sync
+            self._leave(subscriber, room_id)
 
     async def broadcast_to_room(self, room_id: str, message: dict, exclude_websocket: WebSocket = None):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                if connection != exclude_websocket:
-                    try:
-                        await connection.send_text(json.dumps(message))
-                    except:
-                        # Remove broken connections
-                        self.active_connections[room_id].remove(connection)
+        await self.broadcast_many_to_room(room_id, [message], exclude_websocket)
+
+    async def broadcast_many_to_room(self, room_id: str, messages: List[dict], exclude_websocket: WebSocket = None):
+        """Send events to a room, queueing them for subscribers in batch mode"""
+        if room_id not in self.active_connections or not messages:
+            return
+        # Serialize once, not once per recipient; the channel tag is spliced in
+        encoded = [json.dumps(message) for message in messages]
+        channel_prefix = '{"channel": ' + json.dumps(room_id) + ', '
+        tagged = None
+        for subscriber in list(self.active_connections[room_id].values()):
+            if subscriber.websocket == exclude_websocket:
+                continue
+            if subscriber.multiplexed:
+                if tagged is None:
+                    tagged = [channel_prefix + text[1:] for text in encoded]
+                texts = tagged
+            else:
+                texts = encoded
+            if subscriber.pending is not None:
+                subscriber.pending.setdefault(room_id, []).extend(texts)
+                if room_id not in self.flush_tasks:
+                    self.flush_tasks[room_id] = asyncio.create_task(self._flush_room(room_id))
+            else:
+                for text in texts:
+                    await self._send(room_id, subscriber, text)
+
+    async def _flush_room(self, room_id: str):
+        """After the batch window, send each batched subscriber one frame with its queued events"""
+        try:
+            await asyncio.sleep(self.batch_window)
+        finally:
+            self.flush_tasks.pop(room_id, None)
+        for subscriber in list(self.active_connections.get(room_id, {}).values()):
+            await self._send_pending(room_id, subscriber)
+
+    async def _send_pending(self, room_id: str, subscriber: Subscriber):
+        """Send a subscriber the events queued for one room as a single frame"""
+        pending = subscriber.pending.pop(room_id, None) if subscriber.pending else None
+        if not pending:
+            return
+        if len(pending) == 1:
+            text = pending[0]
+        else:
+            text = '{"type": "batch", "events": [' + ", ".join(pending) + ']}'
+        await self._send(room_id, subscriber, text)
 
 manager = ConnectionManager()
 
+async def run_room_archival(interval: int):
+    """Cold-tier archival job, enabled when ROOM_ARCHIVE_INTERVAL_SECONDS is set"""
+    archive = (await firestore_service_async()).archive_service
+    logger.info(f"Room archival enabled: every {interval}s, inactive after {archive.inactive_days} days")
+    # Rooms with open sockets are never archived
+    occupied_rooms = lambda: [room_id for room_id, connections in manager.active_connections.items() if connections]
+    await archive.run_periodically(interval, occupied_rooms)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -114,72 +291,198 @@ async def ready():
     """Readiness check endpoint"""
     try:
         # Test Firestore connection
-        firestore = get_firestore_service()
+        firestore = await firestore_service_async()
         await firestore.test_connection()
         return {"status": "ready", "service": "backend", "timestamp": datetime.now().isoformat()}
     except Exception as e:
         logger.error(f"Readiness check failed: {e}")
         return {"status": "not_ready", "error": str(e)}
 
+def _parse_frame(data: str) -> dict:
+    """Decode a client frame; malformed frames raise ValueError"""
+    message_data = json.loads(data)
+    if not isinstance(message_data, dict):
+        raise ValueError("Frame must be a JSON object")
+    return message_data
+
+def _check_event_room(room_id: str, event) -> None:
+    """Events are only written to the room they were sent on"""
+    if event.room_id != room_id:
+        raise ValueError(f"Event for room {event.room_id} sent on room {room_id}")
+
+async def handle_event_batch(room_id: str, user_id: str, websocket: WebSocket, batch: BatchEvent):
+    """Persist a client batch with batched writes and broadcast it in order"""
+    # Reject the whole batch before anything is written
+    for event in batch.events:
+        if isinstance(event, DrawingEvent):
+            _check_event_room(room_id, event.action)
+        elif isinstance(event, MessageEvent):
+            _check_event_room(room_id, event.message)
+    firestore = await firestore_service_async()
+    messages, actions, outbound = [], [], []
+    
+    async def flush():
+        if messages or actions:
+            await firestore.save_room_events(messages, actions)
+            messages.clear()
+            actions.clear()
+        await manager.broadcast_many_to_room(room_id, outbound, exclude_websocket=websocket)
+        outbound.clear()
+    
+    timestamp = datetime.now().isoformat()
+    for event in batch.events:
+        if isinstance(event, DrawingEvent):
+            actions.append(event.action)
+            outbound.append({
+                "type": "drawing",
+                "action": event.action.model_dump(mode="json"),
+                "user_id": user_id,
+                "timestamp": timestamp
+            })
+        elif isinstance(event, MessageEvent):
+            messages.append(event.message)
+            outbound.append({
+                "type": "message",
+                "message": event.message.model_dump(mode="json"),
+                "user_id": user_id,
+                "timestamp": timestamp
+            })
+        elif isinstance(event, ClearCanvasEvent):
+            # Everything before the clear must be stored first so that it gets cleared too
+            await flush()
+            await firestore.clear_drawing_actions(room_id)
+            outbound.append({"type": "clear_canvas", "user_id": user_id, "timestamp": timestamp})
+    await flush()
+
+async def handle_room_event(room_id: str, user_id: str, websocket: WebSocket, message_data: dict):
+    """Persist and broadcast one client frame for a room
+    
+    Invalid frames (validation errors, events for another room) raise ValueError.
+    """
+    message_type = message_data.get("type")
+    logger.debug(f"Received WebSocket message: type={message_type}, room={room_id}, user={user_id}")
+    
+    if message_type == "batch":
+        # Handle many events at once, validated in a single pass
+        await handle_event_batch(room_id, user_id, websocket, BatchEvent.model_validate(message_data))
+    
+    elif message_type == "drawing":
+        # Handle drawing action
+        drawing_action = DrawingAction(**message_data.get("action", {}))
+        _check_event_room(room_id, drawing_action)
+        await (await firestore_service_async()).save_drawing_action(drawing_action)
+        
+        # Broadcast to other users in the room
+        await manager.broadcast_to_room(room_id, {
+            "type": "drawing",
+            "action": drawing_action.model_dump(mode="json"),
+            "user_id": user_id,
+            "timestamp": datetime.now().isoformat()
+        }, exclude_websocket=websocket)
+        
+    elif message_type == "message":
+        # Handle chat message
+        message = Message(**message_data.get("message", {}))
+        _check_event_room(room_id, message)
+        await (await firestore_service_async()).save_message(message)
+        
+        # Broadcast to other users in the room
+        await manager.broadcast_to_room(room_id, {
+            "type": "message",
+            "message": message.model_dump(mode="json"),
+            "user_id": user_id,
+            "timestamp": datetime.now().isoformat()
+        }, exclude_websocket=websocket)
+        
+    elif message_type == "clear_canvas":
+        # Handle canvas clear
+        await (await firestore_service_async()).clear_drawing_actions(room_id)
+        
+        # Broadcast to other users in the room
+        await manager.broadcast_to_room(room_id, {
+            "type": "clear_canvas",
+            "user_id": user_id,
+            "timestamp": datetime.now().isoformat()
+        }, exclude_websocket=websocket)
+
 @app.websocket("/ws/{room_id}/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str):
+async def websocket_endpoint(websocket: WebSocket, room_id: str, user_id: str, batch: bool = False):
     logger.info(f"WebSocket connection attempt: room={room_id}, user={user_id}")
     
     try:
-        await manager.connect(websocket, room_id, user_id)
+        await manager.connect(websocket, room_id, user_id, batch=batch)
         logger.info(f"WebSocket connected successfully: room={room_id}, user={user_id}")
         
         while True:
             data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Handle different message types
-            message_type = message_data.get("type")
-            logger.debug(f"Received WebSocket message: type={message_type}, user={user_id}")
-            
-            if message_type == "drawing":
-                # Handle drawing action
-                drawing_action = DrawingAction(**message_data.get("action", {}))
-                await get_firestore_service().save_drawing_action(room_id, drawing_action)
-                
-                # Broadcast to other users in the room
-                await manager.broadcast_to_room(room_id, {
-                    "type": "drawing",
-                    "action": drawing_action.model_dump(),
-                    "user_id": user_id,
-                    "timestamp": datetime.now().isoformat()
-                }, exclude_websocket=websocket)
-                
-            elif message_type == "message":
-                # Handle chat message
-                message = Message(**message_data.get("message", {}))
-                await get_firestore_service().save_message(room_id, message)
-                
-                # Broadcast to other users in the room
-                await manager.broadcast_to_room(room_id, {
-                    "type": "message",
-                    "message": message.model_dump(),
-                    "user_id": user_id,
-                    "timestamp": datetime.now().isoformat()
-                }, exclude_websocket=websocket)
-                
-            elif message_type == "clear_canvas":
-                # Handle canvas clear
-                await get_firestore_service().clear_drawing_actions(room_id)
-                
-                # Broadcast to other users in the room
-                await manager.broadcast_to_room(room_id, {
-                    "type": "clear_canvas",
-                    "user_id": user_id,
-                    "timestamp": datetime.now().isoformat()
-                }, exclude_websocket=websocket)
+            try:
+                await handle_room_event(room_id, user_id, websocket, _parse_frame(data))
+            except ValueError as e:
+                # A bad frame is answered, not a reason to drop the connection
+                await websocket.send_text(json.dumps({"type": "error", "detail": f"Invalid event: {e}"}))
                 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected: room={room_id}, user={user_id}")
-        manager.disconnect(websocket, user_id)
+        manager.disconnect(websocket)
     except Exception as e:
         logger.error(f"WebSocket error: room={room_id}, user={user_id}, error={e}")
-        manager.disconnect(websocket, user_id)
+        manager.disconnect(websocket)
+
+# Upper bound on the channels one multiplexed connection may subscribe to
+MUX_MAX_CHANNELS = int(os.getenv("MUX_MAX_CHANNELS", 50))
+
+@app.websocket("/ws-mux/{user_id}")
+async def multiplexed_websocket_endpoint(websocket: WebSocket, user_id: str, batch: bool = False):
+    """One connection, many rooms: frames in both directions are tagged with a channel (room ID)"""
+    logger.info(f"Multiplexed WebSocket connection attempt: user={user_id}")
+    
+    try:
+        await manager.connect_multiplexed(websocket, user_id, batch=batch)
+        
+        while True:
+            data = await websocket.receive_text()
+            try:
+                message_data = _parse_frame(data)
+            except ValueError as e:
+                # One bad frame must not drop every subscription on the socket
+                await websocket.send_text(json.dumps({"type": "error", "detail": f"Invalid frame: {e}"}))
+                continue
+            message_type = message_data.get("type")
+            channel = message_data.get("channel")
+            
+            if not isinstance(channel, str) or not channel:
+                await websocket.send_text(json.dumps({"type": "error", "detail": "Missing channel"}))
+            
+            elif message_type == "subscribe":
+                if len(manager.subscribers[websocket].rooms) >= MUX_MAX_CHANNELS:
+                    await websocket.send_text(json.dumps({
+                        "type": "error",
+                        "channel": channel,
+                        "detail": f"Too many channels (max: {MUX_MAX_CHANNELS})"
+                    }))
+                    continue
+                await manager.subscribe(websocket, channel)
+                await websocket.send_text(json.dumps({"type": "subscribed", "channel": channel}))
+            
+            elif message_type == "unsubscribe":
+                await manager.unsubscribe(websocket, channel)
+                await websocket.send_text(json.dumps({"type": "unsubscribed", "channel": channel}))
+            
+            elif manager.is_subscribed(websocket, channel):
+                try:
+                    await handle_room_event(channel, user_id, websocket, message_data)
+                except ValueError as e:
+                    await websocket.send_text(json.dumps({"type": "error", "channel": channel, "detail": f"Invalid event: {e}"}))
+            
+            else:
+                await websocket.send_text(json.dumps({"type": "error", "channel": channel, "detail": "Not subscribed"}))
+    
+    except WebSocketDisconnect:
+        logger.info(f"Multiplexed WebSocket disconnected: user={user_id}")
+        manager.disconnect(websocket)
+    except Exception as e:
+        logger.error(f"Multiplexed WebSocket error: user={user_id}, error={e}")
+        manager.disconnect(websocket)
 
 @app.post("/upload-file")
 async def upload_file(
@@ -192,7 +495,7 @@ async def upload_file(
         logger.info(f"File upload request: {file.filename}, size: {file.size}, room: {room_id}, user: {user_id}")
         
         # Validate file type and size
-        storage = get_storage_service()
+        storage = await storage_service_async()
         
         if not file.filename:
             raise HTTPException(status_code=400, detail="No filename provided")
@@ -205,12 +508,19 @@ async def upload_file(
         
         # Upload file
         logger.info(f"Uploading file to storage...")
-        file_url = await storage.upload_file(file, room_id)
-        logger.info(f"File uploaded successfully: {file_url}")
+        file_path = await storage.upload_file(file, room_id)
+        try:
+            file_url = await storage.generate_signed_url(file_path)
+        except Exception:
+            # Nothing references the object yet, so don't leave it orphaned
+            await storage.delete_file(file_path)
+            raise
+        logger.info(f"File uploaded successfully: {file_path}")
         
         return {
             "success": True,
             "file_url": file_url,
+            "file_path": file_path,
             "filename": file.filename,
             "file_size": file.size,
             "file_type": file.content_type
@@ -221,13 +531,43 @@ async def upload_file(
         logger.error(f"File upload error: {e}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+class SignFilesRequest(BaseModel):
+    paths: List[str]
+    expiration_minutes: int = 60
+
+@app.post("/files/sign")
+async def sign_files(request: SignFilesRequest):
+    """Sign URLs for every attachment of a message page in one call"""
+    if len(request.paths) > 100:
+        raise HTTPException(status_code=400, detail="Too many paths (max: 100)")
+    if not 1 <= request.expiration_minutes <= 7 * 24 * 60:
+        raise HTTPException(status_code=400, detail="expiration_minutes must be between 1 and 10080")
+    
+    try:
+        storage = await storage_service_async()
+        paths = {reference: storage.blob_path_from_url(reference) for reference in request.paths}
+        invalid = [reference for reference, path in paths.items() if not storage.is_signable_path(path)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Paths cannot be signed: {', '.join(invalid)}")
+        
+        signed = await storage.generate_signed_urls(list(paths.values()), request.expiration_minutes)
+        return {
+            "urls": {reference: signed[path] for reference, path in paths.items()},
+            "expiration_minutes": request.expiration_minutes
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"File signing error: {e}")
+        raise HTTPException(status_code=500, detail=f"Signing failed: {str(e)}")
+
 @app.get("/test-storage")
 async def test_storage():
     """Test storage service connection"""
     try:
-        storage = get_storage_service()
+        storage = await storage_service_async()
         bucket_name = storage.bucket_name
-        bucket_exists = storage.bucket.exists()
+        bucket_exists = await asyncio.to_thread(storage.check_bucket)
         
         return {
             "bucket_name": bucket_name,
@@ -241,33 +581,161 @@ async def test_storage():
             "status": "error"
         }
 
+# Responses smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+
+def _etag_matches(if_none_match: str, etag: str) -> Optional[str]:
+    """Compare If-None-Match against a base ETag, ignoring encoding suffixes
+    
+    Returns the matching tag as the client sent it (so a 304 echoes the
+    -gzip/-br variant it cached), or None when nothing matches.
+    """
+    if if_none_match.strip() == "*":
+        return etag
+    base = etag.strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            continue  # Strong comparison only
+        tag = candidate.strip('"')
+        if tag in (base, f"{base}-gzip", f"{base}-br"):
+            return f'"{tag}"'
+    return None
+
+def _compressed_response(request: Request, payload: dict, etag: str = None) -> Response:
+    """JSON response compressed with brotli or gzip when the client accepts it"""
+    response = JSONResponse(jsonable_encoder(payload))
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    body = response.body
+    encoding = None
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        accepted = {part.split(";")[0].strip() for part in request.headers.get("accept-encoding", "").split(",")}
+        if "br" in accepted:
+            body, encoding = brotli.compress(body, quality=4), "br"
+        elif "gzip" in accepted:
+            body, encoding = gzip.compress(body, compresslevel=6), "gzip"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if etag:
+        # Strong ETags must differ per encoding
+        headers["ETag"] = f'{etag[:-1]}-{encoding}"' if encoding else etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def _room_history_response(request: Request, room_id: str, kind: str, variant: str, load) -> Response:
+    """Serve room history with a version-derived ETag, answering 304 when unchanged"""
+    firestore = await firestore_service_async()
+    # Read the version before the data so a concurrent write can only make the ETag older, never staler
+    version = await firestore.get_room_version(room_id)
+    etag = f'"{kind}-{version}-{variant}"'
+    if_none_match = request.headers.get("if-none-match")
+    matched = _etag_matches(if_none_match, etag) if if_none_match else None
+    if matched:
+        return Response(status_code=304, headers={"ETag": matched, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"})
+    
+    items = await load(firestore)
+    # Empty results may hide a failed query, so they are never made cacheable
+    return _compressed_response(request, {kind: items}, etag if items else None)
+
 @app.get("/messages/{room_id}")
-async def get_messages(room_id: str, limit: int = 50):
+async def get_messages(request: Request, room_id: str, limit: int = 50):
     """Get messages for a room"""
     try:
-        firestore = get_firestore_service()
-        messages = await firestore.get_messages(room_id, limit)
-        return {"messages": messages}
+        return await _room_history_response(
+            request, room_id, "messages", f"limit{limit}",
+            lambda firestore: firestore.get_messages(room_id, limit)
+        )
     except Exception as e:
         logger.error(f"Error getting messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/drawing-actions/{room_id}")
-async def get_drawing_actions(room_id: str):
+async def get_drawing_actions(request: Request, room_id: str):
     """Get drawing actions for a room"""
     try:
-        firestore = get_firestore_service()
-        actions = await firestore.get_drawing_actions(room_id)
-        return {"actions": actions}
+        return await _room_history_response(
+            request, room_id, "actions", "all",
+            lambda firestore: firestore.get_drawing_actions(room_id)
+        )
     except Exception as e:
         logger.error(f"Error getting drawing actions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def require_admin(request: Request):
+    """Allow the request only with the ADMIN_TOKEN bearer token"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/loop-lag")
+async def loop_lag(request: Request):
+    """Event-loop lag measured by the watchdog"""
+    require_admin(request)
+    return watchdog.stats()
+
+@app.get("/admin/profile")
+async def profile(request: Request, seconds: float = 10, format: str = "collapsed", threads: str = "loop"):
+    """Capture a time-boxed sampling profile of the running process"""
+    require_admin(request)
+    if not 0 < seconds <= 60:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 60")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be 'loop' or 'all'")
+    
+    # This handler runs on the event loop thread
+    thread_ids = [threading.get_ident()] if threads == "loop" else None
+    try:
+        samples, duration = await asyncio.to_thread(profiler.sample, seconds, thread_ids)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Captured {sum(samples.values())} stack samples in {duration:.1f}s")
+    
+    if format == "speedscope":
+        return JSONResponse(profiler.to_speedscope(samples))
+    return PlainTextResponse(profiler.to_collapsed(samples))
+
+@app.get("/rooms/{room_id}/export")
+async def export_room(request: Request, room_id: str, format: str = "zip"):
+    """Stream a room (messages, drawing actions and files) as a ZIP or tar archive"""
+    require_admin(request)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    
+    firestore = await firestore_service_async()
+    transfer = RoomTransferService(firestore, get_storage_service, archive_service=firestore.archive_service)
+    filename = re.sub(r"[^A-Za-z0-9._-]", "_", room_id)
+    logger.info(f"Exporting room {room_id} as {format}")
+    return StreamingResponse(
+        transfer.export_room(room_id, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'}
+    )
+
+@app.post("/rooms/{room_id}/import")
+async def import_room(request: Request, room_id: str, archive: UploadFile = File(...)):
+    """Load a room archive produced by the export endpoint"""
+    require_admin(request)
+    try:
+        firestore = await firestore_service_async()
+        transfer = RoomTransferService(firestore, get_storage_service)
+        counts = await transfer.import_room(room_id, archive.file)
+        logger.info(f"Imported room {room_id}: {counts}")
+        return {"success": True, "room_id": room_id, "imported": counts}
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid archive: {str(e)}")
+    except Exception as e:
+        logger.error(f"Room import error: {e}")
+        raise HTTPException(status_code=500, detail=f"Import failed: {str(e)}")
+
 @app.get("/rooms")
 async def get_rooms():
     """Get list of available rooms"""
     try:
-        firestore = get_firestore_service()
+        firestore = await firestore_service_async()
         rooms = await firestore.get_rooms()
         return {"rooms": rooms}
     except Exception as e:
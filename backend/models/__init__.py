@@ -1,5 +1,9 @@
 from .message import Message, MessageType
 from .drawing import DrawingAction
 from .user import User
+from .events import BatchEvent, ClientEvent, DrawingEvent, MessageEvent, ClearCanvasEvent
 
-__all__ = ["Message", "MessageType", "DrawingAction", "User"] 
\ No newline at end of file
+__all__ = [
+    "Message", "MessageType", "DrawingAction", "User",
+    "BatchEvent", "ClientEvent", "DrawingEvent", "MessageEvent", "ClearCanvasEvent",
+]
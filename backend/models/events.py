@@ -0,0 +1,25 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Union, Annotated
+
+from .message import Message
+from .drawing import DrawingAction
+
+# Upper bound on the number of events a client may send in one batch frame
+MAX_BATCH_EVENTS = 500
+
+class DrawingEvent(BaseModel):
+    type: Literal["drawing"]
+    action: DrawingAction = Field(..., description="Drawing action to persist and broadcast")
+
+class MessageEvent(BaseModel):
+    type: Literal["message"]
+    message: Message = Field(..., description="Chat message to persist and broadcast")
+
+class ClearCanvasEvent(BaseModel):
+    type: Literal["clear_canvas"]
+
+ClientEvent = Annotated[Union[DrawingEvent, MessageEvent, ClearCanvasEvent], Field(discriminator="type")]
+
+class BatchEvent(BaseModel):
+    type: Literal["batch"]
+    events: List[ClientEvent] = Field(..., max_length=MAX_BATCH_EVENTS, description="Events in send order")
@@ -22,5 +22,6 @@ class Message(BaseModel):
     timestamp: datetime = Field(..., description="Message timestamp")
     room_id: str = Field(..., description="Room ID where message was sent")
     file_url: Optional[str] = Field(None, description="File URL for file messages")
+    file_path: Optional[str] = Field(None, description="Storage path used to sign file URLs")
     file_size: Optional[int] = Field(None, description="File size in bytes")
     file_type: Optional[str] = Field(None, description="File MIME type") 
\ No newline at end of file
@@ -1,4 +1,19 @@
-from .firestore_service import FirestoreService
-from .storage_service import StorageService
+import importlib
 
-__all__ = ["FirestoreService", "StorageService"] 
\ No newline at end of file
+# Services are imported on first access so that importing the package
+# doesn't load the Google Cloud SDKs
+_SERVICE_MODULES = {
+    "FirestoreService": ".firestore_service",
+    "StorageService": ".storage_service",
+    "ArchiveService": ".archive_service",
+    "LoopWatchdog": ".diagnostics_service",
+    "SamplingProfiler": ".diagnostics_service",
+    "RoomTransferService": ".room_transfer_service",
+}
+
+__all__ = list(_SERVICE_MODULES)
+
+def __getattr__(name):
+    if name in _SERVICE_MODULES:
+        return getattr(importlib.import_module(_SERVICE_MODULES[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from typing import List, Dict, Any, Optional, Callable, Iterable, AsyncIterator
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Collections whose documents are moved to cold storage when a room is archived
+ARCHIVED_COLLECTIONS = ('messages', 'drawing_actions')
+
+# Firestore batched writes are limited to 500 operations
+MAX_BATCH_SIZE = 500
+
+def _encode_value(value: Any) -> Any:
+    """JSON fallback that keeps datetimes distinguishable from plain strings"""
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+def encode_record(collection: str, doc_id: str, data: Dict[str, Any]) -> bytes:
+    """Encode a Firestore document as one NDJSON line"""
+    record = {"collection": collection, "id": doc_id, "data": data}
+    return (json.dumps(record, default=_encode_value, separators=(",", ":")) + "\n").encode("utf-8")
+
+def decode_record(line: bytes) -> Dict[str, Any]:
+    """Decode one NDJSON line produced by encode_record"""
+    return json.loads(line, object_hook=_decode_object)
+
+def _read_lines(reader, max_lines: int) -> List[bytes]:
+    lines = []
+    while len(lines) < max_lines:
+        line = reader.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+    return lines
+
+# Stub states: a claim is taken before anything is uploaded or deleted
+ARCHIVING = 'archiving'      # Object being written / hot documents being deleted
+ARCHIVED = 'archived'        # Documents live only in the object
+REHYDRATING = 'rehydrating'  # Object being loaded back into Firestore
+
+class ArchiveClaimLost(RuntimeError):
+    pass
+
+class ArchiveService:
+    """Moves inactive rooms to compressed NDJSON objects and rehydrates them on access
+
+    Every instance runs the archival job, so each step is guarded by the
+    room's stub in Firestore rather than by an in-process lock: the stub is
+    created with a create-only write before anything is uploaded, and every
+    later transition is a compare-and-set on the stub's claim_id. A claim
+    whose heartbeat is older than claim_timeout belonged to a dead instance
+    and is taken over by the next reader.
+    """
+
+    def __init__(self, firestore_service, storage_provider: Callable[[], Any],
+                 inactive_days: Optional[int] = None, batch_size: Optional[int] = None):
+        self.firestore = firestore_service
+        # Storage is resolved lazily so that a hot room never builds a storage client
+        self._storage_provider = storage_provider
+        self.inactive_days = inactive_days if inactive_days is not None else int(os.getenv('ROOM_ARCHIVE_INACTIVE_DAYS', 90))
+        self.batch_size = min(batch_size or int(os.getenv('ROOM_ARCHIVE_BATCH_SIZE', MAX_BATCH_SIZE)), MAX_BATCH_SIZE)
+        # Seconds a room is trusted to be hot before its stub is checked again
+        self.hot_ttl = int(os.getenv('ROOM_ARCHIVE_HOT_TTL', 300))
+        # Seconds without a heartbeat after which another instance's claim is considered dead
+        self.claim_timeout = int(os.getenv('ROOM_ARCHIVE_CLAIM_TIMEOUT', 300))
+        # Seconds between stub checks while another instance holds the room
+        self.claim_poll_interval = 1.0
+        self._hot_rooms: Dict[str, float] = {}  # room_id -> expiry (monotonic)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def archive_path(self, room_id: str, claim_id: str) -> str:
+        # One object per claim, so a late cleanup never deletes a newer archive
+        return f"archives/rooms/{room_id}/{claim_id}.ndjson.gz"
+
+    def _lock(self, room_id: str) -> asyncio.Lock:
+        if room_id not in self._locks:
+            self._locks[room_id] = asyncio.Lock()
+        return self._locks[room_id]
+
+    def _is_known_hot(self, room_id: str) -> bool:
+        expiry = self._hot_rooms.get(room_id)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del self._hot_rooms[room_id]
+            return False
+        return True
+
+    def _mark_hot(self, room_id: str) -> None:
+        self._hot_rooms[room_id] = time.monotonic() + self.hot_ttl
+
+    def _is_stale(self, stub: Dict[str, Any]) -> bool:
+        heartbeat_at = stub.get('heartbeat_at')
+        return heartbeat_at is None or datetime.now(timezone.utc) - heartbeat_at > timedelta(seconds=self.claim_timeout)
+
+    async def _heartbeat(self, room_id: str, claim_id: str, **fields: Any) -> None:
+        """Renew a claim (and update the stub); raise if another instance took it over"""
+        fields['heartbeat_at'] = datetime.now(timezone.utc)
+        if not await self.firestore.update_room_archive(room_id, claim_id, fields):
+            raise ArchiveClaimLost(f"Archive claim on room {room_id} was taken over")
+
+    async def archive_inactive_rooms(self, skip_rooms: Iterable[str] = ()) -> List[str]:
+        """Archive every room without activity in the last inactive_days"""
+        skip = set(skip_rooms)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.inactive_days)
+        archived = []
+        for room_id in await self.firestore.get_inactive_room_ids(cutoff):
+            if room_id in skip:
+                continue
+            try:
+                last_activity = await self.firestore.get_last_activity(room_id)
+                # Rooms with nothing to archive are left alone
+                if last_activity is None or last_activity >= cutoff:
+                    continue
+                if await self.archive_room(room_id) is not None:
+                    archived.append(room_id)
+            except Exception as e:
+                print(f"Error archiving room {room_id}: {e}")
+        return archived
+
+    async def archive_room(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """Stream a room's documents to cold storage, then delete the hot documents
+
+        Returns the stub, or None when the room is already claimed by an
+        archive or a rehydration (on this or another instance).
+        """
+        async with self._lock(room_id):
+            # The provider may block while the storage client is built
+            storage = await asyncio.to_thread(self._storage_provider)
+            claim_id = uuid.uuid4().hex
+            path = self.archive_path(room_id, claim_id)
+            now = datetime.now(timezone.utc)
+            stub = {"room_id": room_id, "state": ARCHIVING, "claim_id": claim_id, "path": path,
+                    "claimed_at": now, "heartbeat_at": now}
+            if not await self.firestore.claim_room_archive(room_id, stub):
+                return None
+            self._hot_rooms.pop(room_id, None)
+            archived_ids: Dict[str, List[str]] = {collection: [] for collection in ARCHIVED_COLLECTIONS}
+
+            # Upload first: hot documents are only deleted once the object is complete
+            try:
+                writer = await asyncio.to_thread(storage.open_archive_writer, path)
+            except BaseException:
+                await self.firestore.delete_room_archive(room_id, claim_id)
+                raise
+            try:
+                for collection in ARCHIVED_COLLECTIONS:
+                    async for page in self.firestore.iter_room_documents(collection, room_id, self.batch_size):
+                        chunk = b"".join(encode_record(collection, doc_id, data) for doc_id, data in page)
+                        await asyncio.to_thread(writer.write, chunk)
+                        archived_ids[collection].extend(doc_id for doc_id, _ in page)
+                        await self._heartbeat(room_id, claim_id)
+                await asyncio.to_thread(writer.close)
+                counts = {collection: len(ids) for collection, ids in archived_ids.items()}
+                # From here on a dead claim is recovered by rehydrating the object
+                await self._heartbeat(room_id, claim_id, uploaded_at=datetime.now(timezone.utc), counts=counts)
+            except BaseException:
+                # Never leave a partial archive behind: finalize and delete it, then release the room
+                try:
+                    if not writer.closed:
+                        await asyncio.to_thread(writer.close)
+                finally:
+                    await storage.delete_file(path)
+                    await self.firestore.delete_room_archive(room_id, claim_id)
+                raise
+
+            # Only delete what made it into the archive; documents saved meanwhile stay hot
+            # and are merged with the archive on rehydration. Readers wait while the claim
+            # is held, and each batch first checks the claim has not been taken over.
+            try:
+                for collection, doc_ids in archived_ids.items():
+                    for start in range(0, len(doc_ids), self.batch_size):
+                        await self._heartbeat(room_id, claim_id)
+                        await self.firestore.delete_documents(collection, doc_ids[start:start + self.batch_size], self.batch_size)
+            except BaseException:
+                # The object is complete: let the next reader rehydrate the room from it
+                # right away instead of waiting for the claim to time out
+                await self.firestore.update_room_archive(room_id, claim_id, {"state": ARCHIVED})
+                raise
+
+            archived_at = datetime.now(timezone.utc)
+            await self._heartbeat(room_id, claim_id, state=ARCHIVED, archived_at=archived_at)
+            return dict(stub, state=ARCHIVED, archived_at=archived_at, counts=counts)
+
+    async def ensure_room_hot(self, room_id: str) -> None:
+        """Rehydrate an archived room back into Firestore before it is read
+
+        While another instance is archiving or rehydrating the room this waits
+        for it, so a read never observes (or restores) a half-deleted room.
+        """
+        if self._is_known_hot(room_id):
+            return
+        async with self._lock(room_id):
+            while True:
+                stub = await self.firestore.get_room_archive(room_id)
+                if stub is None:
+                    break
+                if stub.get('state', ARCHIVED) == ARCHIVED or self._is_stale(stub):
+                    await self._rehydrate(room_id, stub)
+                else:
+                    await asyncio.sleep(self.claim_poll_interval)
+            self._mark_hot(room_id)
+
+    async def _rehydrate(self, room_id: str, stub: Dict[str, Any]) -> None:
+        """Take the room over from an archived stub (or a dead claim) and restore it"""
+        claim_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        taken = await self.firestore.update_room_archive(room_id, stub.get('claim_id'), {
+            "state": REHYDRATING, "claim_id": claim_id, "claimed_at": now, "heartbeat_at": now,
+        })
+        if not taken:
+            return  # Another instance moved first; the caller re-reads the stub
+
+        # The provider may block while the storage client is built
+        storage = await asyncio.to_thread(self._storage_provider)
+        # An archive that died before its upload completed never deleted anything
+        if stub.get('state', ARCHIVED) != ARCHIVING or 'uploaded_at' in stub:
+            try:
+                await self._restore(room_id, claim_id, stub['path'])
+            except BaseException:
+                # Hand the room back so the next reader retries instead of waiting out the claim
+                await self.firestore.update_room_archive(room_id, claim_id, {"state": ARCHIVED})
+                raise
+
+        # The stub goes first so a failed cleanup never hides rehydrated documents
+        if await self.firestore.delete_room_archive(room_id, claim_id):
+            await storage.delete_file(stub['path'])
+            # Rehydration counts as activity, so the room is not archived again right away
+            await self.firestore.bump_room_version(room_id)
+
+    async def _restore(self, room_id: str, claim_id: str, path: str) -> None:
+        async for records in self.iter_archived_records(path):
+            await self._heartbeat(room_id, claim_id)
+            await self.firestore.batch_set_documents(
+                [(record['collection'], record['id'], record['data']) for record in records]
+            )
+
+    async def iter_archived_records(self, path: str, batch_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield the records of an archive object, batch_size at a time"""
+        # The provider may block while the storage client is built
+        storage = await asyncio.to_thread(self._storage_provider)
+        reader = await asyncio.to_thread(storage.open_archive_reader, path)
+        try:
+            while True:
+                lines = await asyncio.to_thread(_read_lines, reader, batch_size or self.batch_size)
+                if not lines:
+                    return
+                yield [decode_record(line) for line in lines]
+        finally:
+            await asyncio.to_thread(reader.close)
+
+    async def settled_archive(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """Wait until no instance is moving the room; return its stub if archived, None if hot
+
+        Unlike ensure_room_hot this never rehydrates an archived room, so reads
+        such as exports can use the archive object in place.
+        """
+        while True:
+            stub = await self.firestore.get_room_archive(room_id)
+            if stub is None or stub.get('state', ARCHIVED) == ARCHIVED:
+                return stub
+            if self._is_stale(stub):
+                # Recovering a dead claim is what restores the room
+                async with self._lock(room_id):
+                    await self._rehydrate(room_id, stub)
+            else:
+                await asyncio.sleep(self.claim_poll_interval)
+
+    async def run_periodically(self, interval_seconds: int,
+                               skip_rooms_provider: Callable[[], Iterable[str]] = lambda: ()) -> None:
+        """Background job: archive inactive rooms every interval_seconds"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                archived = await self.archive_inactive_rooms(skip_rooms_provider())
+                if archived:
+                    print(f"Archived {len(archived)} inactive rooms: {', '.join(archived)}")
+            except Exception as e:
+                print(f"Error running room archival: {e}")
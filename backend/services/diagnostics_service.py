@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter
+from typing import Dict, Any, Optional, Tuple, Iterable
+
+# (function name, filename, first line) from the outermost to the innermost frame
+Stack = Tuple[Tuple[str, str, int], ...]
+
+def _frame_stack(frame) -> Stack:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+class LoopWatchdog:
+    """Measures event-loop lag and prints the loop thread's stack when the loop stalls"""
+
+    def __init__(self, interval: Optional[float] = None, threshold: Optional[float] = None):
+        self.interval = interval if interval is not None else int(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', 100)) / 1000
+        self.threshold = threshold if threshold is not None else int(os.getenv('LOOP_LAG_THRESHOLD_MS', 250)) / 1000
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> None:
+        """Start measuring; must be called from the event loop being watched"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_lag = max(0.0, now - expected)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._last_beat = now
+
+    def _watch(self) -> None:
+        # Runs in its own thread so it can observe the loop while the loop is blocked
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat - self.interval
+            if stalled_for <= self.threshold or reported_beat == last_beat:
+                continue
+            reported_beat = last_beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>\n"
+            print(f"Warning: event loop blocked for {stalled_for * 1000:.0f}ms, loop thread stack:\n{stack}", end="")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "last_lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+            "threshold_ms": self.threshold * 1000,
+        }
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+class SamplingProfiler:
+    """Samples thread stacks of the running process without restarting it"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, thread_ids: Optional[Iterable[int]] = None) -> Tuple[Counter, float]:
+        """Collect stacks for `seconds` (blocking; run it in a worker thread)
+
+        Returns a Counter of stacks prefixed with the thread name, and the
+        wall-clock duration actually sampled.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already being captured")
+        try:
+            wanted = set(thread_ids) if thread_ids is not None else None
+            own_id = threading.get_ident()
+            samples: Counter = Counter()
+            started = time.monotonic()
+            deadline = started + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id or (wanted is not None and thread_id not in wanted):
+                        continue
+                    thread_frame = (f"thread:{names.get(thread_id, thread_id)}", "", 0)
+                    samples[(thread_frame,) + _frame_stack(frame)] += 1
+                time.sleep(self.interval)
+            return samples, time.monotonic() - started
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def to_collapsed(samples: Counter) -> str:
+        """Render samples in collapsed-stack format (flamegraph.pl, speedscope, ...)"""
+        lines = []
+        for stack, count in samples.most_common():
+            frames = ";".join(name if not filename else f"{name} ({filename}:{line})" for name, filename, line in stack)
+            lines.append(f"{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def to_speedscope(samples: Counter, name: str = "main.app") -> Dict[str, Any]:
+        """Render samples as a speedscope sampled profile weighted by sample count"""
+        frame_index: Dict[Tuple[str, str, int], int] = {}
+        frames = []
+        stacks = []
+        weights = []
+        for stack, count in samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    function, filename, line = frame
+                    frames.append({"name": function, "file": filename, "line": line} if filename else {"name": function})
+                indexes.append(frame_index[frame])
+            stacks.append(indexes)
+            weights.append(count)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "backend sampling profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "none",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": stacks,
+                "weights": weights,
+            }],
+        }
@@ -1,7 +1,9 @@
 import os
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Set
 from datetime import datetime
 import asyncio
+from google.api_core.exceptions import AlreadyExists
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 from dotenv import load_dotenv
@@ -19,11 +21,93 @@ class FirestoreService:
         # For local development, you can use gcloud auth application-default login
         self.db = firestore.AsyncClient()
         
+        # Set by the app to lazily rehydrate archived rooms on first access
+        self.archive_service = None
+        
+        # room_id -> (version, fetched_at); versions written by other instances
+        # become visible once the cached entry is older than the TTL
+        self._room_versions: Dict[str, Tuple[int, float]] = {}
+        self.room_version_ttl = float(os.getenv('ROOM_VERSION_TTL', 2))
+        
+        # A document sustains about one write per second, so event writes only mark
+        # their room and the version bumps are coalesced to one per room per interval
+        self.room_version_interval = float(os.getenv('ROOM_VERSION_BUMP_INTERVAL', 1))
+        self._pending_bumps: Set[str] = set()
+        self._bump_task: Optional[asyncio.Task] = None
+    
+    async def ensure_room_hot(self, room_id: str) -> None:
+        """Rehydrate a room from cold storage if it has been archived"""
+        if self.archive_service is not None:
+            await self.archive_service.ensure_room_hot(room_id)
+        
+    def _bump_room_version(self, batch, room_id: str) -> None:
+        """Add a room version increment to a write batch"""
+        doc_ref = self.db.collection('room_versions').document(room_id)
+        batch.set(doc_ref, {
+            'room_id': room_id,
+            'version': firestore.Increment(1),
+            'updated_at': firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+    
+    async def _write_room_versions(self, room_ids: List[str]) -> None:
+        for start in range(0, len(room_ids), 500):
+            batch = self.db.batch()
+            chunk = room_ids[start:start + 500]
+            for room_id in chunk:
+                self._bump_room_version(batch, room_id)
+            await batch.commit()
+            # The new values are only known server-side; re-read them on next use
+            for room_id in chunk:
+                self._room_versions.pop(room_id, None)
+    
+    async def _commit_room_events(self, batch, *room_ids: str) -> None:
+        """Commit a write batch and schedule the version bumps of its rooms"""
+        await batch.commit()
+        self._pending_bumps.update(room_ids)
+        if self._bump_task is None:
+            self._bump_task = asyncio.create_task(self._flush_room_versions_later())
+    
+    async def _flush_room_versions_later(self) -> None:
+        try:
+            await asyncio.sleep(self.room_version_interval)
+        finally:
+            self._bump_task = None
+        await self.flush_room_versions()
+    
+    async def flush_room_versions(self) -> None:
+        """Write the pending room version bumps now (also called on shutdown)"""
+        room_ids, self._pending_bumps = list(self._pending_bumps), set()
+        try:
+            await self._write_room_versions(room_ids)
+        except Exception as e:
+            print(f"Error bumping room versions: {e}")
+            # Keep them for the next flush rather than leaving caches on a stale version
+            self._pending_bumps.update(room_ids)
+            if self._bump_task is None:
+                self._bump_task = asyncio.create_task(self._flush_room_versions_later())
+    
+    async def bump_room_version(self, room_id: str) -> None:
+        """Bump the room version right away after a bulk change (clear, import, rehydration)"""
+        self._pending_bumps.discard(room_id)
+        await self._write_room_versions([room_id])
+    
+    async def get_room_version(self, room_id: str) -> int:
+        """Get the room version counter, bumped at most room_version_interval after every persisted event"""
+        cached = self._room_versions.get(room_id)
+        if cached is not None and time.monotonic() - cached[1] < self.room_version_ttl:
+            return cached[0]
+        
+        doc = await self.db.collection('room_versions').document(room_id).get()
+        version = doc.to_dict().get('version', 0) if doc.exists else 0
+        self._room_versions[room_id] = (version, time.monotonic())
+        return version
+    
     async def save_message(self, message: Message) -> None:
         """Save message to Firestore"""
         try:
-            doc_ref = self.db.collection('messages').document(message.id)
-            await doc_ref.set(message.model_dump())
+            batch = self.db.batch()
+            batch.set(self.db.collection('messages').document(message.id), message.model_dump())
+            await self._commit_room_events(batch, message.room_id)
         except Exception as e:
             print(f"Error saving message: {e}")
             raise
@@ -31,6 +115,7 @@ class FirestoreService:
     async def get_messages(self, room_id: str, limit: int = 50) -> List[Dict[str, Any]]:
         """Get messages for a room"""
         try:
+            await self.ensure_room_hot(room_id)
             query = (self.db.collection('messages')
                     .where(filter=FieldFilter("room_id", "==", room_id))
                     .order_by("timestamp", direction=firestore.Query.DESCENDING)
@@ -51,15 +136,44 @@ class FirestoreService:
     async def save_drawing_action(self, action: DrawingAction) -> None:
         """Save drawing action to Firestore"""
         try:
-            doc_ref = self.db.collection('drawing_actions').document(action.id)
-            await doc_ref.set(action.model_dump())
+            batch = self.db.batch()
+            batch.set(self.db.collection('drawing_actions').document(action.id), action.model_dump())
+            await self._commit_room_events(batch, action.room_id)
         except Exception as e:
             print(f"Error saving drawing action: {e}")
             raise
     
+    async def save_room_events(self, messages: List[Message], actions: List[DrawingAction]) -> None:
+        """Save many messages and drawing actions with batched writes"""
+        try:
+            writes = ([('messages', message) for message in messages]
+                      + [('drawing_actions', action) for action in actions])
+            # Firestore batched writes are limited to 500 operations
+            for start in range(0, len(writes), 500):
+                chunk = writes[start:start + 500]
+                batch = self.db.batch()
+                for collection, model in chunk:
+                    batch.set(self.db.collection(collection).document(model.id), model.model_dump())
+                await self._commit_room_events(batch, *{model.room_id for _, model in chunk})
+        except Exception as e:
+            print(f"Error saving room events: {e}")
+            raise
+    
+    async def clear_drawing_actions(self, room_id: str) -> None:
+        """Delete all drawing actions of a room"""
+        try:
+            # An archived room would otherwise bring its drawing back on rehydration
+            await self.ensure_room_hot(room_id)
+            await self.delete_room_documents('drawing_actions', room_id)
+            await self.bump_room_version(room_id)
+        except Exception as e:
+            print(f"Error clearing drawing actions: {e}")
+            raise
+    
     async def get_drawing_actions(self, room_id: str) -> List[Dict[str, Any]]:
         """Get drawing actions for a room"""
         try:
+            await self.ensure_room_hot(room_id)
             query = (self.db.collection('drawing_actions')
                     .where(filter=FieldFilter("room_id", "==", room_id))
                     .order_by("timestamp", direction=firestore.Query.ASCENDING))
@@ -159,4 +273,122 @@ class FirestoreService:
             })
         except Exception as e:
             print(f"Error updating user presence: {e}")
-            raise 
\ No newline at end of file
+            raise
+    
+    async def get_inactive_room_ids(self, cutoff: datetime) -> List[str]:
+        """Get the rooms whose version has not been bumped since cutoff"""
+        # Every persisted event bumps room_versions, so its updated_at tracks room activity
+        query = (self.db.collection('room_versions')
+                .where(filter=FieldFilter("updated_at", "<", cutoff)))
+        docs = await query.get()
+        return [doc.id for doc in docs]
+    
+    async def get_last_activity(self, room_id: str) -> Optional[datetime]:
+        """Get the timestamp of the newest message or drawing action in a room"""
+        latest = None
+        for collection in ('messages', 'drawing_actions'):
+            query = (self.db.collection(collection)
+                    .where(filter=FieldFilter("room_id", "==", room_id))
+                    .order_by("timestamp", direction=firestore.Query.DESCENDING)
+                    .limit(1))
+            docs = await query.get()
+            for doc in docs:
+                timestamp = doc.to_dict().get('timestamp')
+                if isinstance(timestamp, datetime) and (latest is None or timestamp > latest):
+                    latest = timestamp
+        return latest
+    
+    async def iter_room_documents(self, collection: str, room_id: str,
+                                  page_size: int = 500) -> AsyncIterator[List[Tuple[str, Dict[str, Any]]]]:
+        """Yield (doc_id, data) pages of a room's documents using cursor pagination"""
+        base_query = (self.db.collection(collection)
+                     .where(filter=FieldFilter("room_id", "==", room_id))
+                     .order_by("__name__")
+                     .limit(page_size))
+        last_doc = None
+        while True:
+            query = base_query.start_after(last_doc) if last_doc is not None else base_query
+            docs = await query.get()
+            if not docs:
+                return
+            yield [(doc.id, doc.to_dict()) for doc in docs]
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+    
+    async def delete_room_documents(self, collection: str, room_id: str, batch_size: int = 500) -> int:
+        """Delete all of a room's documents in a collection using batched writes"""
+        deleted = 0
+        query = (self.db.collection(collection)
+                .where(filter=FieldFilter("room_id", "==", room_id))
+                .limit(batch_size))
+        while True:
+            docs = await query.get()
+            if not docs:
+                return deleted
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            await batch.commit()
+            deleted += len(docs)
+    
+    async def delete_documents(self, collection: str, doc_ids: List[str], batch_size: int = 500) -> int:
+        """Delete documents by ID using batched writes"""
+        for start in range(0, len(doc_ids), batch_size):
+            batch = self.db.batch()
+            for doc_id in doc_ids[start:start + batch_size]:
+                batch.delete(self.db.collection(collection).document(doc_id))
+            await batch.commit()
+        return len(doc_ids)
+    
+    async def batch_set_documents(self, documents: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """Write (collection, doc_id, data) tuples in a single batch (max 500)"""
+        if not documents:
+            return
+        batch = self.db.batch()
+        for collection, doc_id, data in documents:
+            batch.set(self.db.collection(collection).document(doc_id), data)
+        await batch.commit()
+    
+    async def get_room_archive(self, room_id: str) -> Optional[Dict[str, Any]]:
+        """Get the archive stub of a room, or None if the room is hot"""
+        doc = await self.db.collection('room_archives').document(room_id).get()
+        if doc.exists:
+            return doc.to_dict()
+        return None
+    
+    async def claim_room_archive(self, room_id: str, stub: Dict[str, Any]) -> bool:
+        """Create the archive stub of a room, or return False if another claim holds it"""
+        try:
+            await self.db.collection('room_archives').document(room_id).create(stub)
+            return True
+        except AlreadyExists:
+            return False
+    
+    async def update_room_archive(self, room_id: str, claim_id: Optional[str], fields: Dict[str, Any]) -> bool:
+        """Update the archive stub only while claim_id still holds it"""
+        doc_ref = self.db.collection('room_archives').document(room_id)
+        
+        @firestore.async_transactional
+        async def update(transaction) -> bool:
+            doc = await doc_ref.get(transaction=transaction)
+            if not doc.exists or doc.to_dict().get('claim_id') != claim_id:
+                return False
+            transaction.update(doc_ref, fields)
+            return True
+        
+        return await update(self.db.transaction())
+    
+    async def delete_room_archive(self, room_id: str, claim_id: Optional[str]) -> bool:
+        """Remove the archive stub of a room only while claim_id still holds it"""
+        doc_ref = self.db.collection('room_archives').document(room_id)
+        
+        @firestore.async_transactional
+        async def delete(transaction) -> bool:
+            doc = await doc_ref.get(transaction=transaction)
+            if not doc.exists or doc.to_dict().get('claim_id') != claim_id:
+                return False
+            transaction.delete(doc_ref)
+            return True
+        
+        return await delete(self.db.transaction())
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import tarfile
+import zipfile
+import tempfile
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator, Iterator, Tuple, Set
+from dotenv import load_dotenv
+
+from .archive_service import ARCHIVED_COLLECTIONS, MAX_BATCH_SIZE, encode_record, decode_record
+
+load_dotenv()
+
+# Supported export formats -> media type
+EXPORT_FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+class _Sink:
+    """Write-only stream whose output is drained after every write"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class _ZipStream:
+    """Builds a ZIP archive incrementally; members are written with data descriptors"""
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w")
+
+    def _info(self, name: str, size: int, compress: bool) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        # Attachments are mostly already compressed (images, PDFs, Office files)
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.file_size = size  # Lets zipfile decide on ZIP64 up front
+        return info
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(self._info(name, len(data), compress=True), data)
+        return self._sink.drain()
+
+    async def add_stream(self, name: str, size: int, reader) -> AsyncIterator[bytes]:
+        with self._zip.open(self._info(name, size, compress=False), "w") as member:
+            while True:
+                chunk = await asyncio.to_thread(reader.read, CHUNK_SIZE)
+                if not chunk:
+                    break
+                member.write(chunk)
+                yield self._sink.drain()
+        yield self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
+
+class _TarStream:
+    """Builds a tar archive incrementally from member headers and data"""
+
+    def _header(self, name: str, size: int) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT)
+
+    @staticmethod
+    def _padding(size: int) -> bytes:
+        return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        return self._header(name, len(data)) + data + self._padding(len(data))
+
+    async def add_stream(self, name: str, size: int, reader) -> AsyncIterator[bytes]:
+        yield self._header(name, size)
+        remaining = size
+        while remaining > 0:
+            chunk = await asyncio.to_thread(reader.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise IOError(f"{name} changed while it was being exported")
+            remaining -= len(chunk)
+            yield chunk
+        yield self._padding(size)
+
+    def close(self) -> bytes:
+        # End-of-archive marker
+        return b"\0" * (2 * tarfile.BLOCKSIZE)
+
+def _iter_members(fileobj, archive_format: str) -> Iterator[Tuple[str, Any]]:
+    """Yield (name, readable file) for every regular file in an archive"""
+    if archive_format == "zip":
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, member
+    else:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info)
+
+def _spool(member) -> tempfile.SpooledTemporaryFile:
+    """Copy an archive member out so the archive can move on (spills to disk when large)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE)
+    while True:
+        chunk = member.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+class RoomTransferService:
+    """Streams a room out as a ZIP/tar archive and loads such archives back in"""
+
+    def __init__(self, firestore_service, storage_provider: Callable[[], Any],
+                 page_size: int = MAX_BATCH_SIZE, upload_concurrency: Optional[int] = None,
+                 archive_service=None):
+        self.firestore = firestore_service
+        self._storage_provider = storage_provider
+        # Lets archived rooms be exported from cold storage without rehydrating them
+        self.archive = archive_service
+        self.page_size = min(page_size, MAX_BATCH_SIZE)
+        self.upload_concurrency = upload_concurrency or int(os.getenv('IMPORT_UPLOAD_CONCURRENCY', 4))
+
+    async def export_room(self, room_id: str, archive_format: str = "zip") -> AsyncIterator[bytes]:
+        """Yield the archive of a room chunk by chunk
+
+        Documents are read a page at a time into `<collection>/<page>.ndjson`
+        members and attachments are copied in chunks into `files/`, so memory
+        stays bounded by one page or one chunk whatever the size of the room.
+        An archived room is read from its archive object in place, together with
+        the documents written since it was archived; exporting never rehydrates it.
+        """
+        stub = await self.archive.settled_archive(room_id) if self.archive is not None else None
+        # The provider may block while the storage client is built
+        storage = await asyncio.to_thread(self._storage_provider)
+        files = await asyncio.to_thread(storage.list_room_files, room_id)
+        writer = _ZipStream() if archive_format == "zip" else _TarStream()
+        counts = {collection: 0 for collection in ARCHIVED_COLLECTIONS}
+        page_numbers = {collection: 0 for collection in ARCHIVED_COLLECTIONS}
+        hot_ids: Dict[str, Set[str]] = {collection: set() for collection in ARCHIVED_COLLECTIONS}
+
+        def add_page(collection: str, lines: List[bytes]) -> bytes:
+            page_numbers[collection] += 1
+            counts[collection] += len(lines)
+            return writer.add_bytes(f"{collection}/{page_numbers[collection]:06d}.ndjson", b"".join(lines))
+
+        for collection in ARCHIVED_COLLECTIONS:
+            async for page in self.firestore.iter_room_documents(collection, room_id, self.page_size):
+                if stub is not None:
+                    hot_ids[collection].update(doc_id for doc_id, _ in page)
+                yield add_page(collection, [encode_record(collection, doc_id, doc) for doc_id, doc in page])
+
+        if stub is not None:
+            # Hot copies written after archiving take precedence over the archived ones
+            pending: Dict[str, List[bytes]] = {collection: [] for collection in ARCHIVED_COLLECTIONS}
+            async for records in self.archive.iter_archived_records(stub['path'], self.page_size):
+                for record in records:
+                    collection = record['collection']
+                    if collection not in pending or record['id'] in hot_ids[collection]:
+                        continue
+                    pending[collection].append(encode_record(collection, record['id'], record['data']))
+                    if len(pending[collection]) >= self.page_size:
+                        yield add_page(collection, pending[collection])
+                        pending[collection] = []
+            for collection, lines in pending.items():
+                if lines:
+                    yield add_page(collection, lines)
+
+        prefix = f"rooms/{room_id}/files/"
+        for blob_path, size in files:
+            reader = await asyncio.to_thread(storage.open_file_reader, blob_path)
+            try:
+                async for chunk in writer.add_stream(f"files/{blob_path[len(prefix):]}", size, reader):
+                    if chunk:
+                        yield chunk
+            finally:
+                await asyncio.to_thread(reader.close)
+
+        manifest = {
+            "room_id": room_id,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "counts": dict(counts, files=len(files)),
+        }
+        yield writer.add_bytes("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+        yield writer.close()
+
+    async def import_room(self, room_id: str, fileobj) -> Dict[str, int]:
+        """Load an exported archive into room_id with batched writes and parallel uploads"""
+        # The provider may block while the storage client is built
+        storage = await asyncio.to_thread(self._storage_provider)
+        archive_format = "zip" if await asyncio.to_thread(zipfile.is_zipfile, fileobj) else "tar"
+        await asyncio.to_thread(fileobj.seek, 0)
+        members = _iter_members(fileobj, archive_format)
+
+        counts = {collection: 0 for collection in ARCHIVED_COLLECTIONS}
+        counts["files"] = 0
+        pending: List[Tuple[str, str, Dict[str, Any]]] = []
+        slots = asyncio.Semaphore(self.upload_concurrency)
+        uploads: List[asyncio.Task] = []
+
+        async def upload(blob_path: str, spool):
+            try:
+                await asyncio.to_thread(storage.upload_stream, blob_path, spool)
+            finally:
+                spool.close()
+                slots.release()
+
+        try:
+            while True:
+                entry = await asyncio.to_thread(next, members, None)
+                if entry is None:
+                    break
+                name, member = entry
+                directory, _, filename = name.partition("/")
+
+                if directory in ARCHIVED_COLLECTIONS and filename.endswith(".ndjson") and "/" not in filename:
+                    lines = (await asyncio.to_thread(member.read)).splitlines()
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        record = decode_record(line)
+                        if record["collection"] != directory:
+                            continue
+                        pending.append(self._retarget(directory, record["id"], record["data"], room_id))
+                        counts[directory] += 1
+                        if len(pending) >= MAX_BATCH_SIZE:
+                            await self.firestore.batch_set_documents(pending)
+                            pending = []
+
+                elif directory == "files" and filename and "/" not in filename and filename not in (".", ".."):
+                    if not storage.is_allowed_file_type(filename):
+                        continue
+                    # Bounded: at most upload_concurrency files are spooled at any time
+                    await slots.acquire()
+                    try:
+                        spool = await asyncio.to_thread(_spool, member)
+                    except BaseException:
+                        slots.release()
+                        raise
+                    uploads.append(asyncio.create_task(upload(f"rooms/{room_id}/files/{filename}", spool)))
+                    counts["files"] += 1
+
+            if pending:
+                await self.firestore.batch_set_documents(pending)
+            await asyncio.gather(*uploads)
+        except BaseException:
+            await asyncio.gather(*uploads, return_exceptions=True)
+            raise
+        finally:
+            await asyncio.to_thread(members.close)
+
+        await self.firestore.bump_room_version(room_id)
+        return counts
+
+    @staticmethod
+    def _retarget(collection: str, doc_id: str, data: Dict[str, Any], room_id: str) -> Tuple[str, str, Dict[str, Any]]:
+        """Point a document (and its attachment path) at the room it is imported into
+
+        Document IDs are global per collection, so a document copied from another
+        room gets a new ID derived from the target room and its old ID; keeping the
+        old one would overwrite the source room's document. Re-importing the same
+        archive into the same room stays idempotent.
+        """
+        source_room_id = data.get("room_id")
+        if source_room_id != room_id:
+            doc_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"rooms/{room_id}/{collection}/{doc_id}"))
+            if "id" in data:
+                data["id"] = doc_id
+        source_prefix = f"rooms/{source_room_id}/files/"
+        file_path = data.get("file_path")
+        if isinstance(file_path, str) and file_path.startswith(source_prefix):
+            data["file_path"] = f"rooms/{room_id}/files/{file_path[len(source_prefix):]}"
+        data["room_id"] = room_id
+        return collection, doc_id, data
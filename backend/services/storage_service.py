@@ -1,15 +1,77 @@
 import os
+import gzip
 import uuid
+import asyncio
+import threading
 import mimetypes
-from typing import Optional
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, timedelta
 from fastapi import UploadFile
+from google.auth.credentials import Signing
+from google.auth.transport.requests import Request
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class _BlobGzipFile(gzip.GzipFile):
+    """Gzip stream that also closes the underlying blob reader/writer"""
+
+    def __init__(self, blob_stream, mode: str):
+        super().__init__(fileobj=blob_stream, mode=mode)
+        self._blob_stream = blob_stream
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._blob_stream is not None:
+                blob_stream, self._blob_stream = self._blob_stream, None
+                blob_stream.close()
+
+class SignedUrlCache:
+    """LRU cache of signed URLs keyed by (path, expiration minutes)"""
+
+    def __init__(self, max_size: int = 1024, refresh_margin: timedelta = timedelta(minutes=5)):
+        self.max_size = max_size
+        # URLs closer than this to their expiry are re-signed instead of served
+        self.refresh_margin = refresh_margin
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[str, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path: str, expiration_minutes: int) -> Optional[str]:
+        key = (file_path, expiration_minutes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url, expires_at = entry
+            # Never hand out a URL that expires sooner than a fraction of its lifetime
+            margin = min(self.refresh_margin, timedelta(minutes=expiration_minutes) / 2)
+            if expires_at - datetime.utcnow() <= margin:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url
+
+    def put(self, file_path: str, expiration_minutes: int, url: str, expires_at: datetime) -> None:
+        key = (file_path, expiration_minutes)
+        with self._lock:
+            self._entries[key] = (url, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_path: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == file_path]:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
 class StorageService:
     def __init__(self):
         # Initialize Google Cloud Storage client
@@ -17,21 +79,27 @@ class StorageService:
         # For local development, you can use gcloud auth application-default login
         self.client = storage.Client()
         self.bucket_name = os.getenv('GCS_BUCKET_NAME', 'collaborative-app-files')
-        
+        # No network call here: the bucket handle is resolved lazily by the SDK
+        self.bucket = self.client.bucket(self.bucket_name)
+        self.signed_urls = SignedUrlCache(max_size=int(os.getenv('SIGNED_URL_CACHE_SIZE', 1024)))
+        # Signing runs in worker threads; refresh the shared credentials one at a time
+        self._credentials_lock = threading.Lock()
+    
+    def check_bucket(self) -> bool:
+        """Check that the bucket exists (blocking network call)"""
         try:
-            self.bucket = self.client.bucket(self.bucket_name)
-            
-            # Check if bucket exists, but don't create it automatically in production
+            # Don't create the bucket automatically as it might fail due to permissions
             if not self.bucket.exists():
                 print(f"Warning: Bucket '{self.bucket_name}' does not exist")
                 print("Please create the bucket manually or ensure proper permissions")
-                # Don't create bucket automatically as it might fail due to permissions
+                return False
+            return True
         except Exception as e:
-            print(f"Error initializing storage service: {e}")
+            print(f"Error checking storage bucket: {e}")
             raise
     
     async def upload_file(self, file: UploadFile, room_id: Optional[str] = None) -> str:
-        """Upload a file to Google Cloud Storage and return the public URL"""
+        """Upload a private file to Google Cloud Storage and return its blob path"""
         try:
             # Generate unique filename
             file_extension = os.path.splitext(file.filename)[1] if file.filename else ''
@@ -55,39 +123,89 @@ class StorageService:
             content = await file.read()
             blob.upload_from_string(content)
             
-            # Make blob publicly readable
-            blob.make_public()
-            
-            return blob.public_url
+            # Objects stay private; clients read them through signed URLs
+            return blob_path
             
         except Exception as e:
             print(f"Error uploading file: {e}")
             raise
     
+    def _iam_signing_kwargs(self) -> Dict[str, str]:
+        """Sign through the IAM signBlob API when the credentials hold no private key
+        
+        Cloud Run and other metadata-server credentials cannot sign locally; passing
+        the service account email and a fresh access token makes the client library
+        delegate signing to IAM (requires roles/iam.serviceAccountTokenCreator).
+        """
+        credentials = self.client._credentials
+        if isinstance(credentials, Signing):
+            return {}
+        with self._credentials_lock:
+            if not credentials.valid:
+                credentials.refresh(Request())
+            return {
+                "service_account_email": credentials.service_account_email,
+                "access_token": credentials.token,
+            }
+    
+    def _sign_url(self, file_path: str, expiration_minutes: int) -> str:
+        """Sign a V4 GET URL, reusing a cached one until shortly before it expires"""
+        cached = self.signed_urls.get(file_path, expiration_minutes)
+        if cached is not None:
+            return cached
+        
+        expiration = datetime.utcnow() + timedelta(minutes=expiration_minutes)
+        signed_url = self.bucket.blob(file_path).generate_signed_url(
+            version="v4",
+            expiration=expiration,
+            method="GET",
+            **self._iam_signing_kwargs()
+        )
+        self.signed_urls.put(file_path, expiration_minutes, signed_url, expiration)
+        return signed_url
+    
     async def generate_signed_url(self, file_path: str, expiration_minutes: int = 60) -> str:
         """Generate a signed URL for private file access"""
         try:
-            blob = self.bucket.blob(file_path)
-            
-            # Generate signed URL
-            expiration = datetime.utcnow() + timedelta(minutes=expiration_minutes)
-            signed_url = blob.generate_signed_url(
-                version="v4",
-                expiration=expiration,
-                method="GET"
-            )
-            
-            return signed_url
-            
+            # Signing may refresh credentials and call the IAM API, so keep it off the event loop
+            return await asyncio.to_thread(self._sign_url, file_path, expiration_minutes)
         except Exception as e:
             print(f"Error generating signed URL: {e}")
             raise
     
+    async def generate_signed_urls(self, file_paths: List[str], expiration_minutes: int = 60) -> Dict[str, str]:
+        """Generate signed URLs for many files in one call"""
+        try:
+            unique_paths = list(dict.fromkeys(file_paths))
+            return await asyncio.to_thread(
+                lambda: {path: self._sign_url(path, expiration_minutes) for path in unique_paths}
+            )
+        except Exception as e:
+            print(f"Error generating signed URLs: {e}")
+            raise
+    
+    def blob_path_from_url(self, file_reference: str) -> str:
+        """Resolve a blob path from a path or a legacy public URL of this bucket"""
+        public_prefix = f"https://storage.googleapis.com/{self.bucket_name}/"
+        if file_reference.startswith(public_prefix):
+            return file_reference[len(public_prefix):]
+        return file_reference
+    
+    def is_signable_path(self, file_path: str) -> bool:
+        """Only uploaded attachments may be signed, never archives or other objects"""
+        parts = file_path.split('/')
+        if '' in parts or '.' in parts or '..' in parts:
+            return False
+        if parts[0] == 'files':
+            return len(parts) == 2
+        return len(parts) == 4 and parts[0] == 'rooms' and parts[2] == 'files'
+    
     async def delete_file(self, file_path: str) -> bool:
         """Delete a file from Google Cloud Storage"""
         try:
             blob = self.bucket.blob(file_path)
             blob.delete()
+            self.signed_urls.invalidate(file_path)
             return True
         except Exception as e:
             print(f"Error deleting file: {e}")
@@ -112,6 +230,31 @@ class StorageService:
             print(f"Error getting file info: {e}")
             return None
     
+    def open_archive_writer(self, blob_path: str) -> gzip.GzipFile:
+        """Open a gzip-compressed stream that uploads to blob_path in chunks"""
+        blob = self.bucket.blob(blob_path)
+        return _BlobGzipFile(blob.open("wb", content_type="application/gzip"), "wb")
+    
+    def open_archive_reader(self, blob_path: str) -> gzip.GzipFile:
+        """Open a gzip-compressed blob for streaming, decompressed reads"""
+        blob = self.bucket.blob(blob_path)
+        return _BlobGzipFile(blob.open("rb"), "rb")
+    
+    def list_room_files(self, room_id: str) -> List[Tuple[str, int]]:
+        """List (blob path, size) of every file uploaded to a room"""
+        blobs = self.client.list_blobs(self.bucket, prefix=f"rooms/{room_id}/files/")
+        return [(blob.name, blob.size) for blob in blobs]
+    
+    def open_file_reader(self, file_path: str, chunk_size: int = 1024 * 1024):
+        """Open a blob for chunked, streaming reads"""
+        return self.bucket.blob(file_path).open("rb", chunk_size=chunk_size)
+    
+    def upload_stream(self, file_path: str, fileobj, content_type: Optional[str] = None) -> None:
+        """Upload a file object to a private blob without reading it into memory"""
+        blob = self.bucket.blob(file_path)
+        blob.upload_from_file(fileobj, rewind=True,
+                              content_type=content_type or mimetypes.guess_type(file_path)[0])
+    
     def is_allowed_file_type(self, filename: str) -> bool:
         """Check if file type is allowed"""
         allowed_extensions = {
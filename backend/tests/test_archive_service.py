@@ -0,0 +1,273 @@
+import io
+import gzip
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from services.archive_service import ArchiveService, encode_record, decode_record
+
+class FakeFirestore:
+    """In-memory stand-in for the archive-related FirestoreService methods"""
+
+    def __init__(self, documents, room_versions=None):
+        self.documents = documents  # collection -> {doc_id: data}
+        self.room_versions = room_versions or {}  # room_id -> updated_at of its room_versions doc
+        self.archives = {}
+
+    async def get_inactive_room_ids(self, cutoff):
+        return [room_id for room_id, updated_at in self.room_versions.items() if updated_at < cutoff]
+
+    async def bump_room_version(self, room_id):
+        self.room_versions[room_id] = datetime.now(timezone.utc)
+
+    async def get_last_activity(self, room_id):
+        timestamps = [data['timestamp'] for docs in self.documents.values()
+                      for data in docs.values() if data['room_id'] == room_id]
+        return max(timestamps) if timestamps else None
+
+    async def iter_room_documents(self, collection, room_id, page_size=500):
+        docs = [(doc_id, data) for doc_id, data in sorted(self.documents[collection].items())
+                if data['room_id'] == room_id]
+        for start in range(0, len(docs), page_size):
+            yield docs[start:start + page_size]
+
+    async def delete_documents(self, collection, doc_ids, batch_size=500):
+        for doc_id in doc_ids:
+            self.documents[collection].pop(doc_id, None)
+        return len(doc_ids)
+
+    async def batch_set_documents(self, documents):
+        for collection, doc_id, data in documents:
+            self.documents[collection][doc_id] = data
+
+    async def get_room_archive(self, room_id):
+        stub = self.archives.get(room_id)
+        return dict(stub) if stub is not None else None
+
+    async def claim_room_archive(self, room_id, stub):
+        if room_id in self.archives:
+            return False
+        self.archives[room_id] = dict(stub)
+        return True
+
+    async def update_room_archive(self, room_id, claim_id, fields):
+        stub = self.archives.get(room_id)
+        if stub is None or stub.get('claim_id') != claim_id:
+            return False
+        stub.update(fields)
+        return True
+
+    async def delete_room_archive(self, room_id, claim_id):
+        stub = self.archives.get(room_id)
+        if stub is None or stub.get('claim_id') != claim_id:
+            return False
+        del self.archives[room_id]
+        return True
+
+class _Upload(io.BytesIO):
+    def __init__(self, objects, path):
+        super().__init__()
+        self.objects = objects
+        self.path = path
+
+    def close(self):
+        self.objects[self.path] = self.getvalue()
+        super().close()
+
+class FakeStorage:
+    def __init__(self):
+        self.objects = {}
+
+    def open_archive_writer(self, blob_path):
+        upload = _Upload(self.objects, blob_path)
+        writer = gzip.GzipFile(fileobj=upload, mode="wb")
+        close = writer.close
+        writer.close = lambda: (close(), upload.close())
+        return writer
+
+    def open_archive_reader(self, blob_path):
+        return gzip.GzipFile(fileobj=io.BytesIO(self.objects[blob_path]), mode="rb")
+
+    async def delete_file(self, file_path):
+        return self.objects.pop(file_path, None) is not None
+
+def _room_versions(now):
+    return {'old-room': now - timedelta(days=200), 'new-room': now}
+
+def _documents(now):
+    old = now - timedelta(days=200)
+    return {
+        'messages': {
+            f"msg-{i}": {'room_id': 'old-room', 'content': f"hello {i}", 'timestamp': old + timedelta(minutes=i)}
+            for i in range(7)
+        } | {'msg-new': {'room_id': 'new-room', 'content': 'hi', 'timestamp': now}},
+        'drawing_actions': {
+            f"action-{i}": {'room_id': 'old-room', 'data': {'x': i, 'y': i}, 'timestamp': old}
+            for i in range(3)
+        },
+    }
+
+def test_record_round_trip_preserves_datetimes():
+    """Test NDJSON records keep datetime values intact"""
+    timestamp = datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc)
+    line = encode_record('messages', 'msg-1', {'timestamp': timestamp, 'content': '2024-01-15'})
+
+    assert line.endswith(b"\n")
+    record = decode_record(line)
+    assert record == {'collection': 'messages', 'id': 'msg-1',
+                      'data': {'timestamp': timestamp, 'content': '2024-01-15'}}
+
+def test_archive_inactive_rooms_and_rehydrate():
+    """Test inactive rooms move to cold storage and come back on first access"""
+    now = datetime.now(timezone.utc)
+    firestore = FakeFirestore(_documents(now), _room_versions(now))
+    storage = FakeStorage()
+    archive = ArchiveService(firestore, lambda: storage, inactive_days=90, batch_size=2)
+    original = {collection: dict(docs) for collection, docs in firestore.documents.items()}
+
+    archived = asyncio.run(archive.archive_inactive_rooms())
+
+    assert archived == ['old-room']
+    assert list(firestore.documents['messages']) == ['msg-new']
+    assert firestore.documents['drawing_actions'] == {}
+    stub = firestore.archives['old-room']
+    assert stub['state'] == 'archived'
+    assert stub['counts'] == {'messages': 7, 'drawing_actions': 3}
+    assert list(storage.objects) == [stub['path']]
+
+    asyncio.run(archive.ensure_room_hot('old-room'))
+
+    assert firestore.documents == original
+    assert firestore.archives == {}
+    assert storage.objects == {}
+    # Rehydration counts as activity, so the next run leaves the room alone
+    assert asyncio.run(archive.archive_inactive_rooms()) == []
+
+def test_archive_finds_rooms_from_room_versions():
+    """Test candidates come from room_versions, not from the documents themselves"""
+    now = datetime.now(timezone.utc)
+    firestore = FakeFirestore(_documents(now), {'new-room': now})
+    archive = ArchiveService(firestore, FakeStorage, inactive_days=90)
+
+    assert asyncio.run(archive.archive_inactive_rooms()) == []
+    assert firestore.archives == {}
+
+def test_archive_skips_occupied_rooms():
+    """Test rooms with open connections are not archived"""
+    now = datetime.now(timezone.utc)
+    firestore = FakeFirestore(_documents(now), _room_versions(now))
+    archive = ArchiveService(firestore, FakeStorage, inactive_days=90)
+
+    archived = asyncio.run(archive.archive_inactive_rooms(skip_rooms=['old-room']))
+
+    assert archived == []
+    assert firestore.archives == {}
+
+class LateWriteFirestore(FakeFirestore):
+    """Simulates a message saved after the room was streamed to the archive"""
+
+    async def update_room_archive(self, room_id, claim_id, fields):
+        if 'uploaded_at' in fields:
+            self.documents['messages']['msg-late'] = {'room_id': room_id, 'content': 'late', 'timestamp': fields['uploaded_at']}
+        return await super().update_room_archive(room_id, claim_id, fields)
+
+def test_archive_keeps_documents_written_after_streaming():
+    """Test only archived documents are deleted from the hot collections"""
+    firestore = LateWriteFirestore(_documents(datetime.now(timezone.utc)))
+    storage = FakeStorage()
+    archive = ArchiveService(firestore, lambda: storage, inactive_days=90)
+
+    asyncio.run(archive.archive_room('old-room'))
+
+    assert set(firestore.documents['messages']) == {'msg-new', 'msg-late'}
+
+    asyncio.run(archive.ensure_room_hot('old-room'))
+
+    assert len(firestore.documents['messages']) == 9
+
+class FailingFirestore(FakeFirestore):
+    async def iter_room_documents(self, collection, room_id, page_size=500):
+        if collection == 'drawing_actions':
+            raise RuntimeError("stream interrupted")
+        async for page in super().iter_room_documents(collection, room_id, page_size):
+            yield page
+
+def test_failed_archive_leaves_no_partial_object():
+    """Test a failed archive run deletes its upload and keeps the room hot"""
+    firestore = FailingFirestore(_documents(datetime.now(timezone.utc)))
+    storage = FakeStorage()
+    archive = ArchiveService(firestore, lambda: storage, inactive_days=90)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(archive.archive_room('old-room'))
+
+    assert storage.objects == {}
+    assert firestore.archives == {}
+    assert len(firestore.documents['messages']) == 8
+
+class ConcurrentReadFirestore(FakeFirestore):
+    """Another instance reads the room while this one is deleting the archived documents"""
+
+    def __init__(self, documents, reader_provider):
+        super().__init__(documents)
+        self.reader_provider = reader_provider
+        self.read = None
+
+    async def delete_documents(self, collection, doc_ids, batch_size=500):
+        if self.read is None:
+            self.read = asyncio.create_task(self.reader_provider().ensure_room_hot('old-room'))
+            await asyncio.sleep(0.05)
+        return await super().delete_documents(collection, doc_ids, batch_size)
+
+def test_reader_waits_for_archive_in_progress():
+    """Test a room read during archiving is rehydrated only once the archive completed"""
+    storage = FakeStorage()
+    instances = []
+    firestore = ConcurrentReadFirestore(_documents(datetime.now(timezone.utc)), lambda: instances[1])
+    instances.extend(ArchiveService(firestore, lambda: storage, inactive_days=90, batch_size=2) for _ in range(2))
+    instances[1].claim_poll_interval = 0.01
+    original = {collection: dict(docs) for collection, docs in firestore.documents.items()}
+
+    async def run():
+        await instances[0].archive_room('old-room')
+        await firestore.read
+
+    asyncio.run(run())
+
+    assert firestore.documents == original
+    assert firestore.archives == {}
+    assert storage.objects == {}
+
+def test_concurrent_archives_claim_the_room_once():
+    """Test two instances archiving the same room produce one archive"""
+    firestore = FakeFirestore(_documents(datetime.now(timezone.utc)))
+    storage = FakeStorage()
+    instances = [ArchiveService(firestore, lambda: storage, inactive_days=90) for _ in range(2)]
+
+    async def run():
+        return await asyncio.gather(*(instance.archive_room('old-room') for instance in instances))
+
+    stubs = [stub for stub in asyncio.run(run()) if stub is not None]
+
+    assert len(stubs) == 1
+    assert list(storage.objects) == [stubs[0]['path']]
+
+def test_dead_archive_claim_is_recovered():
+    """Test a claim abandoned mid-delete is taken over and the room restored"""
+    firestore = FakeFirestore(_documents(datetime.now(timezone.utc)))
+    storage = FakeStorage()
+    archive = ArchiveService(firestore, lambda: storage, inactive_days=90)
+    original = {collection: dict(docs) for collection, docs in firestore.documents.items()}
+    asyncio.run(archive.archive_room('old-room'))
+
+    # As if the archiving instance died after the upload, while deleting documents
+    firestore.archives['old-room'].update(state='archiving', heartbeat_at=datetime.now(timezone.utc) - timedelta(hours=1))
+    firestore.documents['messages']['msg-0'] = original['messages']['msg-0']
+    other = ArchiveService(firestore, lambda: storage, inactive_days=90)
+    asyncio.run(other.ensure_room_hot('old-room'))
+
+    assert firestore.documents == original
+    assert firestore.archives == {}
+    assert storage.objects == {}
+
+if __name__ == "__main__":
+    pytest.main([__file__])
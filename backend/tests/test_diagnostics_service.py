@@ -0,0 +1,55 @@
+import time
+import asyncio
+import threading
+import pytest
+from services.diagnostics_service import LoopWatchdog, SamplingProfiler
+
+def test_watchdog_reports_blocked_loop(capsys):
+    """Test the watchdog logs the stack of a call that blocks the event loop"""
+    watchdog = LoopWatchdog(interval=0.02, threshold=0.1)
+
+    async def blocking_handler():
+        watchdog.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.4)
+        await asyncio.sleep(0.05)
+        watchdog.stop()
+
+    asyncio.run(blocking_handler())
+
+    assert watchdog.stalls == 1
+    assert watchdog.stats()["max_lag_ms"] >= 300
+    output = capsys.readouterr().out
+    assert "event loop blocked" in output
+    assert "blocking_handler" in output
+
+def test_sampling_profiler_formats():
+    """Test collapsed and speedscope output of a sampled thread"""
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    try:
+        profiler = SamplingProfiler(interval=0.002)
+        samples, duration = profiler.sample(0.1, thread_ids=[worker.ident])
+    finally:
+        stop.set()
+        worker.join()
+
+    assert duration >= 0.1
+    collapsed = profiler.to_collapsed(samples)
+    assert collapsed.startswith("thread:busy;")
+    assert "busy_worker" in collapsed
+
+    speedscope = profiler.to_speedscope(samples)
+    profile = speedscope["profiles"][0]
+    assert profile["type"] == "sampled"
+    assert len(profile["samples"]) == len(profile["weights"])
+    assert sum(profile["weights"]) == sum(samples.values())
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from services.firestore_service import FirestoreService
+from models.drawing import DrawingAction
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append((doc_ref, data))
+
+    async def commit(self):
+        self.db.commits.append(self.writes)
+
+class FakeDb:
+    """Records committed batches as lists of ((collection, doc_id), data)"""
+
+    def __init__(self):
+        self.commits = []
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, doc_id):
+        return (self.name, doc_id)
+
+def _service(interval):
+    service = FirestoreService.__new__(FirestoreService)
+    service.db = FakeDb()
+    service._room_versions = {}
+    service.room_version_interval = interval
+    service._pending_bumps = set()
+    service._bump_task = None
+    return service
+
+def _action(i, room_id='room-1'):
+    return DrawingAction(id=f"a{i}", user_id="u", room_id=room_id, action_type="draw",
+                         data={"x": i}, timestamp=datetime.now(timezone.utc))
+
+def test_room_version_bumps_are_coalesced():
+    """Test a burst of events writes each room version once, outside the event batches"""
+    service = _service(interval=0.01)
+
+    async def run():
+        for i in range(20):
+            await service.save_drawing_action(_action(i, room_id='room-1' if i % 2 else 'room-2'))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    event_commits, version_commits = service.db.commits[:20], service.db.commits[20:]
+    assert all(doc_ref[0] == 'drawing_actions' for writes in event_commits for doc_ref, _ in writes)
+    assert len(version_commits) == 1
+    assert sorted(doc_ref for doc_ref, _ in version_commits[0]) == [('room_versions', 'room-1'), ('room_versions', 'room-2')]
+
+def test_flush_room_versions_writes_pending_bumps():
+    """Test pending bumps can be flushed right away (on shutdown)"""
+    service = _service(interval=60)
+
+    async def run():
+        await service.save_drawing_action(_action(1))
+        await service.flush_room_versions()
+        service._bump_task.cancel()
+
+    asyncio.run(run())
+
+    assert [doc_ref for doc_ref, _ in service.db.commits[-1]] == [('room_versions', 'room-1')]
+    assert service._pending_bumps == set()
+
+if __name__ == "__main__":
+    pytest.main([__file__])
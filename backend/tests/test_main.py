@@ -1,5 +1,11 @@
+import os
+import json
+import asyncio
+import sys
+import subprocess
 import pytest
 from fastapi.testclient import TestClient
+import main
 from main import app
 
 client = TestClient(app)
@@ -37,6 +43,116 @@ def test_websocket_endpoint():
     # Actual WebSocket testing would require more complex setup
     pass
 
+class FakeEventFirestore:
+    def __init__(self):
+        self.saved_actions = []
+
+    async def save_room_events(self, messages, actions):
+        self.saved_actions.extend(actions)
+
+def test_websocket_batch_frames(monkeypatch):
+    """Test inbound batch frames are saved together and reach batch-mode peers in few frames"""
+    fake = FakeEventFirestore()
+    monkeypatch.setattr(main, "firestore_service", fake)
+    actions = [
+        {
+            "id": f"action-{i}",
+            "user_id": "sender",
+            "action_type": "draw",
+            "data": {"x": i, "y": i},
+            "timestamp": "2024-01-15T10:30:00",
+            "room_id": "batch-room"
+        }
+        for i in range(3)
+    ]
+
+    with client.websocket_connect("/ws/batch-room/receiver?batch=true") as receiver:
+        with client.websocket_connect("/ws/batch-room/sender") as sender:
+            sender.send_json({"type": "batch", "events": [{"type": "drawing", "action": a} for a in actions]})
+
+            received = []
+            while len(received) < 4:
+                frame = receiver.receive_json()
+                received.extend(frame["events"] if frame["type"] == "batch" else [frame])
+
+    assert [event["type"] for event in received] == ["user_joined", "drawing", "drawing", "drawing"]
+    assert [event["action"]["id"] for event in received[1:]] == ["action-0", "action-1", "action-2"]
+    assert [action.id for action in fake.saved_actions] == ["action-0", "action-1", "action-2"]
+
+def test_multiplexed_websocket(monkeypatch):
+    """Test one multiplexed socket receives channel-tagged frames for each subscribed room"""
+    fake = FakeEventFirestore()
+    monkeypatch.setattr(main, "firestore_service", fake)
+    action = {
+        "id": "action-1",
+        "user_id": "watcher",
+        "action_type": "draw",
+        "data": {"x": 1, "y": 1},
+        "timestamp": "2024-01-15T10:30:00",
+        "room_id": "mux-b"
+    }
+
+    with client.websocket_connect("/ws-mux/watcher") as mux:
+        for channel in ("mux-a", "mux-b"):
+            mux.send_json({"type": "subscribe", "channel": channel})
+            assert mux.receive_json() == {"type": "subscribed", "channel": channel}
+
+        with client.websocket_connect("/ws/mux-a/alice"):
+            frame = mux.receive_json()
+            assert (frame["channel"], frame["type"], frame["user_id"]) == ("mux-a", "user_joined", "alice")
+
+        frame = mux.receive_json()
+        assert (frame["channel"], frame["type"], frame["user_id"]) == ("mux-a", "user_left", "alice")
+
+        with client.websocket_connect("/ws/mux-b/bob") as bob:
+            assert mux.receive_json()["channel"] == "mux-b"
+            mux.send_json({"type": "batch", "channel": "mux-b", "events": [{"type": "drawing", "action": action}]})
+            frame = bob.receive_json()
+            assert frame["type"] == "drawing"
+            assert "channel" not in frame
+
+            mux.send_json({"type": "unsubscribe", "channel": "mux-a"})
+            assert mux.receive_json() == {"type": "unsubscribed", "channel": "mux-a"}
+            mux.send_json({"type": "clear_canvas", "channel": "mux-a"})
+            assert mux.receive_json()["detail"] == "Not subscribed"
+
+    assert [action.id for action in fake.saved_actions] == ["action-1"]
+    assert "mux-a" not in main.manager.active_connections
+    assert not any(subscriber.user_id == "watcher" for subscriber in main.manager.subscribers.values())
+
+def test_multiplexed_websocket_rejects_bad_frames(monkeypatch):
+    """Test events for other rooms and malformed frames get an error frame, not a disconnect"""
+    fake = FakeEventFirestore()
+    monkeypatch.setattr(main, "firestore_service", fake)
+    action = {
+        "id": "action-1",
+        "user_id": "watcher",
+        "action_type": "draw",
+        "data": {"x": 1, "y": 1},
+        "timestamp": "2024-01-15T10:30:00",
+        "room_id": "other-room"
+    }
+
+    with client.websocket_connect("/ws-mux/watcher") as mux:
+        mux.send_json({"type": "subscribe", "channel": "mux-c"})
+        assert mux.receive_json() == {"type": "subscribed", "channel": "mux-c"}
+
+        mux.send_json({"type": "batch", "channel": "mux-c", "events": [{"type": "drawing", "action": action}]})
+        frame = mux.receive_json()
+        assert (frame["type"], frame["channel"]) == ("error", "mux-c")
+        assert "other-room" in frame["detail"]
+
+        mux.send_text("{not json")
+        assert mux.receive_json()["type"] == "error"
+        mux.send_json({"type": "drawing", "channel": "mux-c", "action": {"id": "broken"}})
+        assert mux.receive_json()["type"] == "error"
+
+        # Still connected and subscribed
+        mux.send_json({"type": "unsubscribe", "channel": "mux-c"})
+        assert mux.receive_json() == {"type": "unsubscribed", "channel": "mux-c"}
+
+    assert fake.saved_actions == []
+
 def test_upload_file_endpoint():
     """Test file upload endpoint structure"""
     # This endpoint requires a file, so we just test that it exists
@@ -44,6 +160,11 @@ def test_upload_file_endpoint():
     response = client.get("/docs")
     assert response.status_code == 200
 
+def test_sign_files_rejects_too_many_paths():
+    """Test batch signing is bounded"""
+    response = client.post("/files/sign", json={"paths": [f"files/{i}.png" for i in range(101)]})
+    assert response.status_code == 400
+
 def test_messages_endpoint():
     """Test messages endpoint structure"""
     # Test with a dummy room_id
@@ -58,12 +179,150 @@ def test_drawing_actions_endpoint():
     # This might fail if Firestore is not available, but that's expected
     assert response.status_code in [200, 500]
 
+class BrokenWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        raise RuntimeError("connection closed")
+
+def test_failed_send_leaves_room():
+    """Test a broken connection is dropped from both the room and its subscriptions"""
+    manager = main.ConnectionManager(batch_window=0)
+    websocket = BrokenWebSocket()
+
+    async def run():
+        await manager.connect(websocket, "test-room", "user")
+        await manager.broadcast_to_room("test-room", {"type": "message"})
+
+    asyncio.run(run())
+
+    assert "test-room" not in manager.active_connections
+    assert manager.subscribers[websocket].rooms == set()
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+def test_unsubscribe_sends_queued_batch_events_first():
+    """Test events queued for a room are delivered before leaving it, and never after"""
+    manager = main.ConnectionManager(batch_window=60)
+    sender, watcher = RecordingWebSocket(), RecordingWebSocket()
+
+    async def run():
+        await manager.connect_multiplexed(watcher, "watcher", batch=True)
+        await manager.subscribe(watcher, "room-a")
+        await manager.subscribe(watcher, "room-b")
+        await manager.connect(sender, "room-a", "sender")
+        await manager.broadcast_to_room("room-b", {"type": "message", "n": 1})
+        await manager.unsubscribe(watcher, "room-a")
+        for task in list(manager.flush_tasks.values()):
+            task.cancel()
+
+    asyncio.run(run())
+
+    assert watcher.sent == [{"channel": "room-a", "type": "user_joined", "user_id": "sender",
+                             "timestamp": watcher.sent[0]["timestamp"]}]
+    assert manager.subscribers[watcher].pending == {"room-b": ['{"channel": "room-b", "type": "message", "n": 1}']}
+
+class FakeHistoryFirestore:
+    """Counts history queries so conditional requests can be checked"""
+
+    def __init__(self, actions):
+        self.version = 1
+        self.actions = actions
+        self.queries = 0
+
+    async def get_room_version(self, room_id):
+        return self.version
+
+    async def get_drawing_actions(self, room_id):
+        self.queries += 1
+        return self.actions
+
+def test_drawing_actions_conditional_get(monkeypatch):
+    """Test history endpoints answer If-None-Match with 304 until the room version changes"""
+    fake = FakeHistoryFirestore([{"id": "a1", "data": {"x": 1}}])
+    monkeypatch.setattr(main, "firestore_service", fake)
+
+    response = client.get("/drawing-actions/test-room")
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert response.json() == {"actions": fake.actions}
+
+    response = client.get("/drawing-actions/test-room", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert fake.queries == 1
+
+    fake.version += 1
+    response = client.get("/drawing-actions/test-room", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert fake.queries == 2
+
+def test_history_compression(monkeypatch):
+    """Test large history responses are compressed with encoding-specific ETags"""
+    fake = FakeHistoryFirestore([{"id": f"a{i}", "data": {"x": i, "y": i}} for i in range(200)])
+    monkeypatch.setattr(main, "firestore_service", fake)
+
+    response = client.get("/drawing-actions/test-room", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"].endswith('-gzip"')
+    assert len(response.json()["actions"]) == 200
+
+    gzip_etag = response.headers["etag"]
+    response = client.get("/drawing-actions/test-room", headers={"If-None-Match": gzip_etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == gzip_etag
+
 def test_rooms_endpoint():
     """Test rooms endpoint structure"""
     response = client.get("/rooms")
     # This might fail if Firestore is not available, but that's expected
     assert response.status_code in [200, 500]
 
+def test_import_does_not_load_cloud_sdks():
+    """Test that importing main defers the Google Cloud SDK imports"""
+    probe = "import sys, main; print(any(m in sys.modules for m in ('google.cloud.firestore', 'google.cloud.storage')))"
+    result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.strip().splitlines()[-1] == "False"
+
+def test_admin_endpoints_require_token(monkeypatch):
+    """Test admin endpoints are closed without the admin token"""
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/admin/loop-lag").status_code == 403
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/profile", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert client.get("/admin/loop-lag", headers={"Authorization": "Bearer secret"}).status_code == 200
+
+def test_room_export_requires_admin(monkeypatch):
+    """Test room export and import are admin-only"""
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/rooms/test-room/export").status_code == 403
+    assert client.post("/rooms/test-room/import", files={"archive": ("room.zip", b"")}).status_code == 403
+
+def test_admin_profile(monkeypatch):
+    """Test a short on-demand profile of the running app"""
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    headers = {"Authorization": "Bearer secret"}
+
+    response = client.get("/admin/profile?seconds=0.1", headers=headers)
+    assert response.status_code == 200
+    assert response.text.startswith("thread:")
+
+    response = client.get("/admin/profile?seconds=0.1&format=speedscope&threads=all", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["profiles"][0]["type"] == "sampled"
+
 def test_cors_headers():
     """Test that CORS headers are present"""
     response = client.options("/")
@@ -3,6 +3,8 @@ from datetime import datetime
 from models.message import Message, MessageType
 from models.drawing import DrawingAction, DrawingActionType
 from models.user import User
+from models.events import BatchEvent, DrawingEvent, ClearCanvasEvent, MAX_BATCH_EVENTS
+from pydantic import ValidationError
 
 def test_message_model():
     """Test Message model creation and validation"""
@@ -123,5 +125,31 @@ def test_drawing_action_serialization():
     assert "action_type" in action_dict
     assert "data" in action_dict
 
+def test_batch_event_model():
+    """Test BatchEvent validates mixed events in one pass"""
+    action = {
+        "id": "action-123",
+        "user_id": "user-123",
+        "action_type": "draw",
+        "data": {"x": 1, "y": 2},
+        "timestamp": datetime.now().isoformat(),
+        "room_id": "room-123"
+    }
+    batch = BatchEvent.model_validate({
+        "type": "batch",
+        "events": [{"type": "drawing", "action": action}, {"type": "clear_canvas"}]
+    })
+
+    assert isinstance(batch.events[0], DrawingEvent)
+    assert batch.events[0].action.action_type == DrawingActionType.DRAW
+    assert isinstance(batch.events[1], ClearCanvasEvent)
+
+def test_batch_event_rejects_invalid_events():
+    """Test BatchEvent rejects unknown event types and oversized batches"""
+    with pytest.raises(ValidationError):
+        BatchEvent.model_validate({"type": "batch", "events": [{"type": "unknown"}]})
+    with pytest.raises(ValidationError):
+        BatchEvent.model_validate({"type": "batch", "events": [{"type": "clear_canvas"}] * (MAX_BATCH_EVENTS + 1)})
+
 if __name__ == "__main__":
     pytest.main([__file__]) 
\ No newline at end of file
@@ -0,0 +1,139 @@
+import io
+import copy
+import asyncio
+import tarfile
+import zipfile
+import pytest
+from datetime import datetime, timezone
+from services.archive_service import ArchiveService
+from services.room_transfer_service import RoomTransferService
+from tests.test_archive_service import FakeFirestore, FakeStorage
+
+class FakeTransferFirestore(FakeFirestore):
+    def __init__(self, documents):
+        super().__init__(documents)
+        self.bumped = []
+
+    async def bump_room_version(self, room_id):
+        self.bumped.append(room_id)
+
+class FakeFileStorage:
+    def __init__(self, files):
+        self.files = files  # blob path -> bytes
+
+    def list_room_files(self, room_id):
+        prefix = f"rooms/{room_id}/files/"
+        return [(path, len(data)) for path, data in sorted(self.files.items()) if path.startswith(prefix)]
+
+    def open_file_reader(self, file_path):
+        return io.BytesIO(self.files[file_path])
+
+    def upload_stream(self, file_path, fileobj, content_type=None):
+        self.files[file_path] = fileobj.read()
+
+    def is_allowed_file_type(self, filename):
+        return filename.endswith(".png")
+
+class FakeArchiveFileStorage(FakeFileStorage, FakeStorage):
+    def __init__(self, files):
+        FakeFileStorage.__init__(self, files)
+        FakeStorage.__init__(self)
+
+def _room(now):
+    documents = {
+        'messages': {
+            f"msg-{i}": {'room_id': 'source', 'content': f"hello {i}", 'timestamp': now,
+                         'file_path': 'rooms/source/files/a.png' if i == 0 else None}
+            for i in range(5)
+        },
+        'drawing_actions': {
+            'action-1': {'room_id': 'source', 'data': {'x': 1}, 'timestamp': now},
+        },
+    }
+    files = {'rooms/source/files/a.png': b"\x89PNG" + bytes(range(256)) * 10}
+    return documents, files
+
+async def _export(transfer, room_id, archive_format):
+    return b"".join([chunk async for chunk in transfer.export_room(room_id, archive_format)])
+
+@pytest.mark.parametrize("archive_format", ["zip", "tar"])
+def test_export_and_import_round_trip(archive_format):
+    """Test a room survives export and import into another room"""
+    now = datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc)
+    documents, files = _room(now)
+    firestore = FakeTransferFirestore(documents)
+    storage = FakeFileStorage(files)
+    transfer = RoomTransferService(firestore, lambda: storage, page_size=2)
+
+    archive = asyncio.run(_export(transfer, 'source', archive_format))
+
+    if archive_format == "zip":
+        names = zipfile.ZipFile(io.BytesIO(archive)).namelist()
+    else:
+        names = tarfile.open(fileobj=io.BytesIO(archive)).getnames()
+    assert names == [
+        "messages/000001.ndjson", "messages/000002.ndjson", "messages/000003.ndjson",
+        "drawing_actions/000001.ndjson", "files/a.png", "manifest.json",
+    ]
+
+    counts = asyncio.run(transfer.import_room('target', io.BytesIO(archive)))
+
+    assert counts == {'messages': 5, 'drawing_actions': 1, 'files': 1}
+    assert storage.files['rooms/target/files/a.png'] == files['rooms/source/files/a.png']
+    copied = [data for data in firestore.documents['messages'].values() if data['room_id'] == 'target']
+    assert len(copied) == 5
+    assert {data['content'] for data in copied} == {f"hello {i}" for i in range(5)}
+    attachment = next(data for data in copied if data['file_path'])
+    assert attachment['timestamp'] == now
+    assert attachment['file_path'] == 'rooms/target/files/a.png'
+    assert firestore.bumped == ['target']
+
+def test_cross_room_import_leaves_source_room_unchanged():
+    """Test importing into another room copies documents instead of moving them"""
+    now = datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc)
+    documents, files = _room(now)
+    documents['messages']['msg-0']['id'] = 'msg-0'
+    original = copy.deepcopy(documents)
+    firestore = FakeTransferFirestore(documents)
+    storage = FakeFileStorage(files)
+    transfer = RoomTransferService(firestore, lambda: storage)
+
+    archive = asyncio.run(_export(transfer, 'source', "zip"))
+    asyncio.run(transfer.import_room('target', io.BytesIO(archive)))
+
+    for collection, docs in original.items():
+        for doc_id, data in docs.items():
+            assert firestore.documents[collection][doc_id] == data
+    assert len(firestore.documents['messages']) == 10
+    assert len(firestore.documents['drawing_actions']) == 2
+    copied_ids = [doc_id for doc_id, data in firestore.documents['messages'].items() if data.get('id')]
+    assert all(firestore.documents['messages'][doc_id]['id'] == doc_id for doc_id in copied_ids)
+
+    # Importing the same archive again overwrites the copies rather than duplicating them
+    asyncio.run(transfer.import_room('target', io.BytesIO(archive)))
+    assert len(firestore.documents['messages']) == 10
+
+def test_export_archived_room_without_rehydrating():
+    """Test an archived room is exported from cold storage and stays archived"""
+    now = datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc)
+    documents, files = _room(now)
+    firestore = FakeTransferFirestore(documents)
+    storage = FakeArchiveFileStorage(files)
+    archive = ArchiveService(firestore, lambda: storage, batch_size=2)
+    asyncio.run(archive.archive_room('source'))
+    # Written after the room was archived
+    firestore.documents['messages']['msg-late'] = {'room_id': 'source', 'content': 'late', 'timestamp': now, 'file_path': None}
+    transfer = RoomTransferService(firestore, lambda: storage, page_size=2, archive_service=archive)
+
+    archive_bytes = asyncio.run(_export(transfer, 'source', "zip"))
+
+    assert firestore.archives['source']['state'] == 'archived'
+    assert firestore.archives['source']['path'] in storage.objects
+    assert list(firestore.documents['messages']) == ['msg-late']
+
+    counts = asyncio.run(transfer.import_room('target', io.BytesIO(archive_bytes)))
+
+    assert counts == {'messages': 6, 'drawing_actions': 1, 'files': 1}
+
+if __name__ == "__main__":
+    pytest.main([__file__])
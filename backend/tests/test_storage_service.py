@@ -0,0 +1,73 @@
+import pytest
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from services.storage_service import SignedUrlCache, StorageService
+
+def test_signed_url_cache_hit():
+    """Test cached URLs are reused per path and expiry"""
+    cache = SignedUrlCache()
+    cache.put("rooms/r/files/a.png", 60, "https://signed/a", datetime.utcnow() + timedelta(minutes=60))
+
+    assert cache.get("rooms/r/files/a.png", 60) == "https://signed/a"
+    assert cache.get("rooms/r/files/a.png", 15) is None
+    assert cache.get("rooms/r/files/b.png", 60) is None
+
+def test_signed_url_cache_refreshes_before_expiry():
+    """Test URLs close to expiry are dropped so they get re-signed"""
+    cache = SignedUrlCache(refresh_margin=timedelta(minutes=5))
+    cache.put("files/a.png", 60, "https://signed/a", datetime.utcnow() + timedelta(minutes=4))
+
+    assert cache.get("files/a.png", 60) is None
+    assert len(cache) == 0
+
+def test_signed_url_cache_evicts_least_recently_used():
+    """Test the cache is bounded and evicts the least recently used entry"""
+    cache = SignedUrlCache(max_size=2)
+    expires_at = datetime.utcnow() + timedelta(minutes=60)
+    cache.put("files/a.png", 60, "a", expires_at)
+    cache.put("files/b.png", 60, "b", expires_at)
+    cache.get("files/a.png", 60)
+    cache.put("files/c.png", 60, "c", expires_at)
+
+    assert cache.get("files/a.png", 60) == "a"
+    assert cache.get("files/b.png", 60) is None
+    assert cache.get("files/c.png", 60) == "c"
+
+def test_signable_paths():
+    """Test only uploaded attachments can be signed"""
+    storage = StorageService.__new__(StorageService)
+    storage.bucket_name = "bucket"
+
+    assert storage.is_signable_path("rooms/room-1/files/a.png")
+    assert storage.is_signable_path("files/a.png")
+    assert not storage.is_signable_path("archives/rooms/room-1.ndjson.gz")
+    assert not storage.is_signable_path("rooms/../files/a.png")
+    assert storage.blob_path_from_url("https://storage.googleapis.com/bucket/files/a.png") == "files/a.png"
+
+class KeylessCredentials:
+    """Metadata-server style credentials: no private key, email known after refresh"""
+
+    def __init__(self):
+        self.valid = False
+        self.token = None
+        self.service_account_email = "default"
+
+    def refresh(self, request):
+        self.valid = True
+        self.token = "access-token"
+        self.service_account_email = "backend@project.iam.gserviceaccount.com"
+
+def test_keyless_credentials_sign_through_iam():
+    """Test credentials without a private key delegate signing to IAM signBlob"""
+    storage = StorageService.__new__(StorageService)
+    storage.client = SimpleNamespace(_credentials=KeylessCredentials())
+    storage._credentials_lock = threading.Lock()
+
+    assert storage._iam_signing_kwargs() == {
+        "service_account_email": "backend@project.iam.gserviceaccount.com",
+        "access_token": "access-token",
+    }
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -117,6 +117,7 @@ export default function Chat({ socket }: ChatProps) {
           timestamp: new Date(),
           roomId: room.id,
           fileUrl: data.file_url,
+          filePath: data.file_path,
           fileSize: data.file_size || file.size,
           fileType: data.file_type || file.type,
         }
@@ -143,6 +144,38 @@ export default function Chat({ socket }: ChatProps) {
     }
   }
 
+  // Signed URLs expire, so re-sign the stored path whenever a file is opened
+  const openFile = async (e: React.MouseEvent<HTMLAnchorElement>, message: Message) => {
+    if (!message.filePath) return
+    e.preventDefault()
+    const opened = window.open('', '_blank')
+
+    try {
+      const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/files/sign`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ paths: [message.filePath] }),
+      })
+
+      if (!response.ok) {
+        const errorData = await response.json()
+        throw new Error(errorData.detail || 'Signing failed')
+      }
+
+      const data = await response.json()
+      const url = data.urls[message.filePath]
+      if (opened) {
+        opened.location.href = url
+      } else {
+        window.open(url, '_blank', 'noopener,noreferrer')
+      }
+    } catch (error) {
+      opened?.close()
+      console.error('Error opening file:', error)
+      toast.error(`Could not open file: ${error instanceof Error ? error.message : 'Unknown error'}`)
+    }
+  }
+
   const getFileIcon = (fileType: string) => {
     if (fileType.startsWith('image/')) {
       return <Image className="w-4 h-4" />
@@ -211,9 +244,10 @@ export default function Chat({ socket }: ChatProps) {
                         </p>
                       )}
                     </div>
-                    {message.fileUrl && (
+                    {(message.fileUrl || message.filePath) && (
                       <a
-                        href={message.fileUrl}
+                        href={message.fileUrl || '#'}
+                        onClick={(e) => openFile(e, message)}
                         target="_blank"
                         rel="noopener noreferrer"
                         className="text-xs opacity-70 hover:opacity-100"
@@ -21,6 +21,7 @@ export interface Message {
   timestamp: Date
   roomId: string
   fileUrl?: string
+  filePath?: string
   fileSize?: number
   fileType?: string
 }
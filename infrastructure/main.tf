@@ -93,6 +93,13 @@ resource "google_project_iam_member" "backend_storage_admin" {
   member  = "serviceAccount:${google_service_account.backend_service_account.email}"
 }
 
+# Cloud Run credentials hold no private key: signed URLs are signed through IAM signBlob
+resource "google_service_account_iam_member" "backend_token_creator" {
+  service_account_id = google_service_account.backend_service_account.name
+  role               = "roles/iam.serviceAccountTokenCreator"
+  member             = "serviceAccount:${google_service_account.backend_service_account.email}"
+}
+
 # Cloud Run service for backend
 resource "google_cloud_run_service" "backend" {
   name     = "collaborative-app-backend-${var.environment}"